@@ -0,0 +1,60 @@
+"""
+Production serving profile: gunicorn -c gunicorn.conf.py main:app
+
+Requests spend most of their time waiting on Datastore, Cloud Storage and
+Auth0, so a few processes with many threads each serve more concurrent
+requests per instance than many single-threaded processes.
+"""
+import logging
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+
+# One process per CPU, threads cover the time spent waiting on backends
+worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Import the app once in the master so workers fork with it already loaded
+preload_app = True
+
+# Recycle workers now and then so slow leaks cannot grow forever
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+# Keep connections from the front end open between requests
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 30))
+
+# Requests longer than this are killed; on SIGTERM in-flight requests get
+# graceful_timeout seconds to finish before workers exit
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 20))
+
+# gRPC channels do not survive fork, so warm up in each worker rather than
+# in the master while the app is preloaded
+warmup_workers = os.environ.get('WARMUP_ON_START', 'false').lower() == 'true'
+os.environ['WARMUP_ON_START'] = 'false'
+
+def post_fork(server, worker):
+    """Drop any backend clients inherited from the master and restart the log writer"""
+    from utils.datastore_client import reset_datastore_client
+    from utils.log import start_listener
+    from utils.storage import reset_storage_client
+    reset_datastore_client()
+    reset_storage_client()
+    start_listener()
+
+def post_worker_init(worker):
+    """Create this worker's backend clients before it accepts requests"""
+    if warmup_workers:
+        from main import warmup
+        try:
+            warmup()
+        except Exception:
+            logging.getLogger(__name__).exception("Error in worker warmup")
+
+def worker_exit(server, worker):
+    """Write out queued log records before the worker exits or is recycled"""
+    from utils.log import stop_listener
+    stop_listener()
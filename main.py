@@ -1,30 +1,100 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, request, jsonify
+import logging
 import os
 
 # Import route modules
 from routes.auth_routes import auth_bp
-from routes.user_routes import user_bp
+from routes.user_routes import upload_avatar_to_storage, user_bp
 from routes.course_routes import course_bp
+from routes.batch_routes import batch_bp
+from routes.profiling_routes import profiling_bp
+from routes.job_routes import job_bp
+from utils.compression import init_compression
+from utils.deadline import init_deadlines
+from utils.datastore_client import get_datastore_client, list_courses, new_entity
+from utils.jobs import get_job_queue
+from utils.log import configure_logging, init_request_logging
+from utils.profiling import init_profiling
+from utils.rate_limit import validate_limits
+from utils.read_policy import validate_policies
+from utils.storage import get_storage_client
+from utils.tenancy import get_tenants, init_tenancy, use_tenant
+from utils.tracing import init_tracing
 
-app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
-# Register blueprints
-app.register_blueprint(auth_bp)
-app.register_blueprint(user_bp)
-app.register_blueprint(course_bp)
+main_bp = Blueprint('main', __name__)
 
-@app.route('/')
+def warmup():
+    """Import backend libraries, create clients and open a Datastore connection per tenant"""
+    import jwt
+    import requests
+    
+    get_storage_client()
+    for tenant_id in get_tenants():
+        with use_tenant(tenant_id):
+            list_courses(get_datastore_client(), 3, 0)
+
+def create_app():
+    """Create the Flask app; backend clients are created lazily on first use"""
+    configure_logging()
+    validate_policies()
+    validate_limits()
+    
+    app = Flask(__name__)
+    init_request_logging(app)
+    init_tenancy(app)
+    init_tracing(app)
+    init_compression(app)
+    init_deadlines(app)
+    init_profiling(app)
+    
+    # Register blueprints
+    app.register_blueprint(main_bp)
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(user_bp)
+    app.register_blueprint(course_bp)
+    app.register_blueprint(job_bp)
+    app.register_blueprint(batch_bp)
+    app.register_blueprint(profiling_bp)
+    
+    if os.environ.get('WARMUP_ON_START', 'false').lower() == 'true':
+        warmup()
+    
+    return app
+
+@main_bp.route('/')
 def home():
     return jsonify({"message": "Tarpaulin API is running"}), 200
 
-@app.route('/test-datastore')
+@main_bp.route('/_ah/warmup')
+def warmup_request():
+    """App Engine warmup request, sent before an instance receives traffic"""
+    try:
+        warmup()
+        return '', 200
+    except Exception as e:
+        logger.exception("Error in warmup")
+        return jsonify({"Error": "Warmup failed"}), 500
+
+@main_bp.route('/metrics')
+def get_metrics():
+    """Process-local counters (single-flight coalescing, etc.)"""
+    from utils import metrics
+    from utils.circuit_breaker import breaker_states
+    from utils.log import dropped_count
+    result = metrics.snapshot()
+    result['log.dropped'] = dropped_count()
+    result['circuits'] = breaker_states()
+    return jsonify(result), 200
+
+@main_bp.route('/test-datastore')
 def test_datastore():
     try:
-        from google.cloud import datastore
-        client = datastore.Client()
+        client = get_datastore_client()
         
         key = client.key('test', 'test1')
-        entity = datastore.Entity(key=key)
+        entity = new_entity(key)
         entity['message'] = 'Datastore is working!'
         client.put(entity)
         
@@ -33,47 +103,64 @@ def test_datastore():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
-@app.route('/populate-users-real')
+def populate_users_job():
+    """Replace all users with the real Auth0 users - runs as a background job"""
+    client = get_datastore_client()
+    
+    # Delete existing users first to avoid duplicates
+    query = client.query(kind='users')
+    query.keys_only()
+    client.delete_multi([user.key for user in query.fetch()])
+    
+    # Real user data with actual sub values from Auth0
+    users_data = [
+        {"role": "admin", "sub": "auth0|683b8e5d7653872d9ac7444c"},
+        {"role": "instructor", "sub": "auth0|683b8efa7653872d9ac74459"},
+        {"role": "instructor", "sub": "auth0|683b8f277653872d9ac7445f"},
+        {"role": "student", "sub": "auth0|683b8f4ba7e405995ecde2e8"},
+        {"role": "student", "sub": "auth0|683b8f67a7e405995ecde2ec"},
+        {"role": "student", "sub": "auth0|683b8f84a7e405995ecde2ef"},
+        {"role": "student", "sub": "auth0|683b8fa7e405995ecde2f3"},
+        {"role": "student", "sub": "auth0|683b8fb3a7e405995ecde2f6"},
+        {"role": "student", "sub": "auth0|683b8fc4a7e405995ecde2f9"},
+    ]
+    
+    entities = []
+    for user_data in users_data:
+        entity = new_entity(client.key('users'))
+        entity.update(user_data)
+        entities.append(entity)
+    client.put_multi(entities)
+    
+    created_users = []
+    for entity in entities:
+        result = dict(entity)
+        result['id'] = entity.key.id
+        created_users.append(result)
+    
+    return {"users_created": len(created_users), "users": created_users}
+
+def accepted_job(job):
+    """Build the 202 response for a queued background job"""
+    return jsonify({
+        "status": "accepted",
+        "job_id": job.id,
+        "job_url": f"{request.host_url.rstrip('/')}/jobs/{job.id}"
+    }), 202
+
+@main_bp.route('/populate-users-real')
 def populate_users_real():
     try:
-        from google.cloud import datastore
-        client = datastore.Client()
-        
-        # Delete existing users first to avoid duplicates
-        query = client.query(kind='users')
-        existing_users = list(query.fetch())
-        for user in existing_users:
-            client.delete(user.key)
-        
-        # Real user data with actual sub values from Auth0
-        users_data = [
-            {"role": "admin", "sub": "auth0|683b8e5d7653872d9ac7444c"},
-            {"role": "instructor", "sub": "auth0|683b8efa7653872d9ac74459"},
-            {"role": "instructor", "sub": "auth0|683b8f277653872d9ac7445f"},
-            {"role": "student", "sub": "auth0|683b8f4ba7e405995ecde2e8"},
-            {"role": "student", "sub": "auth0|683b8f67a7e405995ecde2ec"},
-            {"role": "student", "sub": "auth0|683b8f84a7e405995ecde2ef"},
-            {"role": "student", "sub": "auth0|683b8fa7e405995ecde2f3"},
-            {"role": "student", "sub": "auth0|683b8fb3a7e405995ecde2f6"},
-            {"role": "student", "sub": "auth0|683b8fc4a7e405995ecde2f9"},
-        ]
-        
-        created_users = []
-        for user_data in users_data:
-            key = client.key('users')
-            entity = datastore.Entity(key=key)
-            entity.update(user_data)
-            client.put(entity)
-            
-            result = dict(entity)
-            result['id'] = entity.key.id
-            created_users.append(result)
-        
-        return jsonify({"status": "success", "users_created": len(created_users), "users": created_users}), 200
+        job = get_job_queue().submit(
+            'populate_users',
+            populate_users_job,
+            idempotency_key=request.headers.get('Idempotency-Key')
+        )
+        return accepted_job(job)
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
-@app.route('/decode-token', methods=['POST'])
+@main_bp.route('/decode-token', methods=['POST'])
 def decode_token():
     try:
         import jwt
@@ -85,13 +172,11 @@ def decode_token():
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
-@app.route('/check-storage-bucket')
+@main_bp.route('/check-storage-bucket')
 def check_storage_bucket():
     """Check if the Cloud Storage bucket exists and is accessible"""
     try:
-        from google.cloud import storage
-        
-        storage_client = storage.Client()
+        storage_client = get_storage_client()
         bucket_name = os.environ.get('BUCKET_NAME', 'tume-tarpaulin-avatars')
         
         try:
@@ -121,66 +206,74 @@ def check_storage_bucket():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
-@app.route('/fix-student-subs', methods=['POST'])
+def fix_student_subs_job(data):
+    """Assign student subs from JWTs in order of student id - runs as a background job"""
+    import jwt
+    
+    client = get_datastore_client()
+    
+    # Get all current users
+    query = client.query(kind='users')
+    all_users = list(query.fetch())
+    
+    # Extract student tokens and update subs
+    student_tokens = []
+    for key, token in data.items():
+        if key.startswith('student') and key.endswith('_jwt'):
+            try:
+                decoded = jwt.decode(token, options={"verify_signature": False})
+                sub = decoded.get('sub')
+                if sub:
+                    student_num = int(key.replace('student', '').replace('_jwt', ''))
+                    student_tokens.append((student_num, sub))
+            except Exception as e:
+                logger.warning("Error decoding %s: %s", key, e)
+    
+    # Sort by student number
+    student_tokens.sort(key=lambda x: x[0])
+    
+    # Get all students from database
+    students = [u for u in all_users if u.get('role') == 'student']
+    students.sort(key=lambda x: x.key.id)  # Sort by ID for consistent assignment
+    
+    updated = []
+    for i, (student_num, sub) in enumerate(student_tokens):
+        if i < len(students):
+            student = students[i]
+            student['sub'] = sub
+            updated.append(student)
+            logger.info("Updated student %s with sub %s", student.key.id, sub)
+    client.put_multi(updated)
+    
+    return {
+        "students_updated": len(updated),
+        "message": "Student subs have been updated. Run the tests again."
+    }
+
+@main_bp.route('/fix-student-subs', methods=['POST'])
 def fix_student_subs():
     """Fix the student sub matching issue"""
     try:
-        from google.cloud import datastore
-        import jwt
-        
-        client = datastore.Client()
         data = request.get_json()
         
         if not data:
             return jsonify({"Error": "Send JWT tokens"}), 400
         
-        # Get all current users
-        query = client.query(kind='users')
-        all_users = list(query.fetch())
-        
-        # Extract student tokens and update subs
-        student_tokens = []
-        for key, token in data.items():
-            if key.startswith('student') and key.endswith('_jwt'):
-                try:
-                    decoded = jwt.decode(token, options={"verify_signature": False})
-                    sub = decoded.get('sub')
-                    if sub:
-                        student_num = int(key.replace('student', '').replace('_jwt', ''))
-                        student_tokens.append((student_num, sub))
-                except Exception as e:
-                    print(f"Error decoding {key}: {e}")
-        
-        # Sort by student number
-        student_tokens.sort(key=lambda x: x[0])
-        
-        # Get all students from database
-        students = [u for u in all_users if u.get('role') == 'student']
-        students.sort(key=lambda x: x.key.id)  # Sort by ID for consistent assignment
-        
-        updated_count = 0
-        for i, (student_num, sub) in enumerate(student_tokens):
-            if i < len(students):
-                student = students[i]
-                student['sub'] = sub
-                client.put(student)
-                updated_count += 1
-                print(f"Updated student {student.key.id} with sub {sub}")
-        
-        return jsonify({
-            "status": "success",
-            "students_updated": updated_count,
-            "message": "Student subs have been updated. Run the tests again."
-        }), 200
+        job = get_job_queue().submit(
+            'fix_student_subs',
+            fix_student_subs_job,
+            data,
+            idempotency_key=request.headers.get('Idempotency-Key')
+        )
+        return accepted_job(job)
         
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
-@app.route('/create-test-avatar', methods=['POST'])
+@main_bp.route('/create-test-avatar', methods=['POST'])
 def create_test_avatar():
     """Create a test avatar for testing purposes"""
     try:
-        from google.cloud import storage
         import base64
         
         data = request.get_json()
@@ -192,13 +285,7 @@ def create_test_avatar():
         )
         
         # Upload to Cloud Storage
-        storage_client = storage.Client()
-        bucket_name = os.environ.get('BUCKET_NAME', 'tume-tarpaulin-avatars')
-        bucket = storage_client.bucket(bucket_name)
-        
-        blob_name = f"avatars/{user_id}.png"
-        blob = bucket.blob(blob_name)
-        blob.upload_from_string(test_image_data, content_type='image/png')
+        blob_name = upload_avatar_to_storage(user_id, test_image_data)
         
         return jsonify({
             "status": "success",
@@ -211,12 +298,11 @@ def create_test_avatar():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
-@app.route('/debug-users')
+@main_bp.route('/debug-users')
 def debug_users():
     """Debug endpoint to check user data"""
     try:
-        from google.cloud import datastore
-        client = datastore.Client()
+        client = get_datastore_client()
         
         # Get all users
         query = client.query(kind='users')
@@ -240,5 +326,7 @@ def debug_users():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+app = create_app()
+
 if __name__ == '__main__':
     app.run(host='127.0.0.1', port=8080, debug=True)
\ No newline at end of file
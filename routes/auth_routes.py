@@ -1,13 +1,18 @@
 from flask import Blueprint, request, jsonify
-import requests
+from utils.deadline import BackendUnavailable, call_backend
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 auth_bp = Blueprint('auth', __name__)
 
 @auth_bp.route('/users/login', methods=['POST'])
 def login():
     """User login endpoint"""
     try:
+        import requests
+        
         data = request.get_json()
         if not data or 'username' not in data or 'password' not in data:
             return jsonify({"Error": "The request body is invalid"}), 400
@@ -15,7 +20,7 @@ def login():
         username = data['username']
         password = data['password']
         
-        print(f"Login attempt for: {username}")
+        logger.debug("Login attempt", extra={"username": username})
         
         # Auth0 authentication - Resource Owner Password Grant
         auth0_domain = "dev-kxk3ej4jph3k8f8b.us.auth0.com"
@@ -36,13 +41,16 @@ def login():
             "scope": "openid profile email"
         }
         
-        print(f"Making request to: {token_url}")
-        print(f"Request data: {token_data}")
-        
-        response = requests.post(token_url, json=token_data)
+        # Not retried: a failed password grant should not be replayed
+        response = call_backend('auth0', requests.post, token_url, json=token_data,
+                                idempotent=False, google_retry=False,
+                                trace_attributes={"url": token_url})
         
-        print(f"Auth0 response status: {response.status_code}")
-        print(f"Auth0 response: {response.text}")
+        # Never log the request or response body, they carry credentials and tokens
+        logger.info(
+            "Auth0 token response",
+            extra={"status": response.status_code, "sample_rate": 0.1}
+        )
         
         if response.status_code == 200:
             result = response.json()
@@ -50,6 +58,8 @@ def login():
         else:
             return jsonify({"Error": "Unauthorized"}), 401
             
+    except BackendUnavailable:
+        raise
     except Exception as e:
-        print(f"Login error: {e}")
+        logger.warning("Login error: %s", e)
         return jsonify({"Error": "The request body is invalid"}), 400
\ No newline at end of file
@@ -0,0 +1,122 @@
+from flask import Blueprint, request, jsonify, current_app
+from werkzeug.test import EnvironBuilder
+from concurrent.futures import ThreadPoolExecutor
+from utils.auth import requires_auth, AUTH_PAYLOAD_ENVIRON_KEY, CALLER_ENVIRON_KEY
+from utils.deadline import BackendUnavailable, DEADLINE_ENVIRON_KEY, deadline_var
+from utils.datastore_client import get_datastore_client, get_user_by_sub
+from utils.rate_limit import rate_limited
+from utils.tracing import PARENT_SPAN_ENVIRON_KEY, current_span_var
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+batch_bp = Blueprint('batch', __name__)
+
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 50))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 8))
+ALLOWED_METHODS = {'GET', 'POST', 'PATCH', 'DELETE'}
+
+_executor = None
+
+def get_executor():
+    """Get the thread pool that runs concurrent read sub-requests"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix='batch')
+    return _executor
+
+def is_valid_item(item):
+    """Check a sub-request is {"method", "path"[, "body"]} for a path other than /batch"""
+    return (
+        isinstance(item, dict)
+        and isinstance(item.get('method'), str)
+        and item['method'].upper() in ALLOWED_METHODS
+        and isinstance(item.get('path'), str)
+        and item['path'].startswith('/')
+        and not item['path'].startswith('/batch')
+    )
+
+def run_subrequest(app, item, base_url, headers, shared_environ):
+    """Dispatch one sub-request through the app and return its status and body"""
+    builder = EnvironBuilder(
+        path=item['path'],
+        method=item['method'].upper(),
+        base_url=base_url,
+        headers=headers,
+        json=item.get('body')
+    )
+    environ = builder.get_environ()
+    environ.update(shared_environ)
+    
+    # A fresh app context gives the sub-request its own flask.g; otherwise it
+    # would share the batch's and overwrite its per-request state
+    with app.app_context(), app.request_context(environ):
+        try:
+            response = app.full_dispatch_request()
+        except Exception:
+            # Earlier items may already have written, so one failing item
+            # must not turn the whole batch into a 500 and hide their statuses
+            logger.exception("Error in batch item %s %s", item['method'].upper(), item['path'])
+            return {"status": 500, "body": {"Error": "Internal server error"}}
+        response.direct_passthrough = False
+        if response.is_json:
+            body = response.get_json()
+        else:
+            try:
+                body = response.get_data(as_text=True) or None
+            except UnicodeDecodeError:
+                body = None
+    return {"status": response.status_code, "body": body}
+
+@batch_bp.route('/batch', methods=['POST'])
+@requires_auth
+@rate_limited('batch')
+def batch(payload):
+    """Run a list of sub-requests with one authentication - Protected"""
+    try:
+        data = request.get_json(silent=True)
+        items = data.get('requests') if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items or len(items) > BATCH_MAX_ITEMS:
+            return jsonify({"Error": "The request body is invalid"}), 400
+        if not all(is_valid_item(item) for item in items):
+            return jsonify({"Error": "The request body is invalid"}), 400
+        
+        # Authenticate once and resolve the caller once for every sub-request
+        client = get_datastore_client()
+        shared_environ = {
+            AUTH_PAYLOAD_ENVIRON_KEY: payload,
+            CALLER_ENVIRON_KEY: (payload['sub'], get_user_by_sub(client, payload['sub'])),
+            DEADLINE_ENVIRON_KEY: deadline_var.get(),
+            PARENT_SPAN_ENVIRON_KEY: current_span_var.get()
+        }
+        headers = {"Authorization": request.headers.get("Authorization", "")}
+        app = current_app._get_current_object()
+        base_url = request.host_url
+        
+        # Runs of consecutive GETs execute concurrently; writes run one at a
+        # time in order, so a write always sees the writes before it
+        results = [None] * len(items)
+        i = 0
+        while i < len(items):
+            j = i
+            while j < len(items) and items[j]['method'].upper() == 'GET':
+                j += 1
+            if j > i + 1:
+                futures = [
+                    (k, get_executor().submit(run_subrequest, app, items[k], base_url, headers, shared_environ))
+                    for k in range(i, j)
+                ]
+                for k, future in futures:
+                    results[k] = future.result()
+                i = j
+            else:
+                results[i] = run_subrequest(app, items[i], base_url, headers, shared_environ)
+                i += 1
+        
+        return jsonify({"responses": results}), 200
+    except BackendUnavailable:
+        raise
+    except Exception as e:
+        logger.exception("Error in batch")
+        return jsonify({"Error": "Internal server error"}), 500
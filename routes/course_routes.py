@@ -1,25 +1,45 @@
 from flask import Blueprint, request, jsonify
-from google.cloud import datastore
 from utils.auth import requires_auth
+from utils.rate_limit import rate_limited
+from utils.deadline import BackendUnavailable
+from utils.group_commit import commit_enrollment_writes
+from utils.datastore_client import (
+    forget_course, get_course_entity, get_datastore_client, get_user_by_sub, get_user_entity,
+    list_courses, new_entity
+)
+import logging
+
+logger = logging.getLogger(__name__)
 
 course_bp = Blueprint('courses', __name__)
 
+# Datastore accepts at most 500 keys per batch call
+BATCH_SIZE = 500
+
+def delete_course_enrollments(client, course_id):
+    """Delete all enrollments for a course with a keys-only query and batched deletes"""
+    enrollment_query = client.query(kind='enrollments')
+    enrollment_query.add_filter('course_id', '=', course_id)
+    enrollment_query.keys_only()
+    keys = [enrollment.key for enrollment in enrollment_query.fetch()]
+    
+    for i in range(0, len(keys), BATCH_SIZE):
+        client.delete_multi(keys[i:i + BATCH_SIZE])
+    
+    return len(keys)
+
 @course_bp.route('/courses', methods=['GET'])
 def get_all_courses():
     """Get all courses with pagination - Unprotected"""
     try:
-        client = datastore.Client()
+        client = get_datastore_client()
         
         # Get pagination parameters
         limit = int(request.args.get('limit', 3))
         offset = int(request.args.get('offset', 0))
         
-        # Query courses ordered by subject
-        query = client.query(kind='courses')
-        query.order = ['subject']
-        
-        # Apply pagination
-        courses = list(query.fetch(limit=limit, offset=offset))
+        # Query courses ordered by subject, with pagination
+        courses = list_courses(client, limit, offset)
         
         # Build response
         result = []
@@ -39,18 +59,19 @@ def get_all_courses():
             response["next"] = f"{request.host_url.rstrip('/')}/courses?limit={limit}&offset={next_offset}"
         
         return jsonify(response), 200
+    except BackendUnavailable:
+        raise
     except Exception as e:
-        print(f"Error in get_all_courses: {e}")
+        logger.exception("Error in get_all_courses")
         return jsonify({"Error": "Internal server error"}), 500
 
 @course_bp.route('/courses/<int:course_id>', methods=['GET'])
 def get_course(course_id):
     """Get a specific course - Unprotected"""
     try:
-        client = datastore.Client()
+        client = get_datastore_client()
         
-        course_key = client.key('courses', course_id)
-        course = client.get(course_key)
+        course = get_course_entity(client, course_id, route='course_get')
         
         if not course:
             return jsonify({"Error": "Not found"}), 404
@@ -60,23 +81,24 @@ def get_course(course_id):
         result['self'] = f"{request.host_url.rstrip('/')}/courses/{course.key.id}"
         
         return jsonify(result), 200
+    except BackendUnavailable:
+        raise
     except Exception as e:
-        print(f"Error in get_course: {e}")
+        logger.exception("Error in get_course")
         return jsonify({"Error": "Internal server error"}), 500
 
 @course_bp.route('/courses', methods=['POST'])
 @requires_auth
+@rate_limited('admin')
 def create_course(payload):
     """Create a course - Admin only"""
     try:
-        client = datastore.Client()
+        client = get_datastore_client()
         
         # Check if user is admin
-        query = client.query(kind='users')
-        query.add_filter('sub', '=', payload['sub'])
-        users = list(query.fetch())
+        requesting_user = get_user_by_sub(client, payload['sub'])
         
-        if not users or users[0]['role'] != 'admin':
+        if not requesting_user or requesting_user['role'] != 'admin':
             return jsonify({"Error": "You don't have permission on this resource"}), 403
         
         data = request.get_json()
@@ -86,15 +108,14 @@ def create_course(payload):
             return jsonify({"Error": "The request body is invalid"}), 400
         
         # Validate instructor exists and has instructor role
-        instructor_key = client.key('users', data['instructor_id'])
-        instructor = client.get(instructor_key)
+        instructor = get_user_entity(client, data['instructor_id'])
         
         if not instructor or instructor['role'] != 'instructor':
             return jsonify({"Error": "The request body is invalid"}), 400
         
         # Create course
         course_key = client.key('courses')
-        course = datastore.Entity(key=course_key)
+        course = new_entity(course_key)
         course.update({
             'subject': data['subject'],
             'number': data['number'],
@@ -111,23 +132,24 @@ def create_course(payload):
         
         return jsonify(result), 201
         
+    except BackendUnavailable:
+        raise
     except Exception as e:
-        print(f"Error in create_course: {e}")
+        logger.warning("Error in create_course: %s", e)
         return jsonify({"Error": "The request body is invalid"}), 400
 
 @course_bp.route('/courses/<int:course_id>', methods=['PATCH'])
 @requires_auth
+@rate_limited('admin')
 def update_course(payload, course_id):
     """Update a course - Admin only"""
     try:
-        client = datastore.Client()
+        client = get_datastore_client()
         
         # Check if user is admin
-        query = client.query(kind='users')
-        query.add_filter('sub', '=', payload['sub'])
-        users = list(query.fetch())
+        requesting_user = get_user_by_sub(client, payload['sub'])
         
-        if not users or users[0]['role'] != 'admin':
+        if not requesting_user or requesting_user['role'] != 'admin':
             return jsonify({"Error": "You don't have permission on this resource"}), 403
         
         # Check if course exists
@@ -143,8 +165,7 @@ def update_course(payload, course_id):
         
         # Validate instructor_id if provided
         if 'instructor_id' in data:
-            instructor_key = client.key('users', data['instructor_id'])
-            instructor = client.get(instructor_key)
+            instructor = get_user_entity(client, data['instructor_id'])
             if not instructor or instructor['role'] != 'instructor':
                 return jsonify({"Error": "The request body is invalid"}), 400
         
@@ -155,6 +176,7 @@ def update_course(payload, course_id):
                 course[field] = data[field]
         
         client.put(course)
+        forget_course(course_id)
         
         result = dict(course)
         result['id'] = course.key.id
@@ -162,23 +184,24 @@ def update_course(payload, course_id):
         
         return jsonify(result), 200
         
+    except BackendUnavailable:
+        raise
     except Exception as e:
-        print(f"Error in update_course: {e}")
+        logger.warning("Error in update_course: %s", e)
         return jsonify({"Error": "The request body is invalid"}), 400
 
 @course_bp.route('/courses/<int:course_id>', methods=['DELETE'])
 @requires_auth
+@rate_limited('admin')
 def delete_course(payload, course_id):
     """Delete a course - Admin only"""
     try:
-        client = datastore.Client()
+        client = get_datastore_client()
         
         # Check if user is admin
-        query = client.query(kind='users')
-        query.add_filter('sub', '=', payload['sub'])
-        users = list(query.fetch())
+        requesting_user = get_user_by_sub(client, payload['sub'])
         
-        if not users or users[0]['role'] != 'admin':
+        if not requesting_user or requesting_user['role'] != 'admin':
             return jsonify({"Error": "You don't have permission on this resource"}), 403
         
         # Check if course exists
@@ -188,43 +211,36 @@ def delete_course(payload, course_id):
         if not course:
             return jsonify({"Error": "You don't have permission on this resource"}), 403
         
-        # Delete all enrollments for this course
-        enrollment_query = client.query(kind='enrollments')
-        enrollment_query.add_filter('course_id', '=', course_id)
-        enrollments = list(enrollment_query.fetch())
-        
-        for enrollment in enrollments:
-            client.delete(enrollment.key)
-        
-        # Delete the course
+        # Enrollments go first, so a failure part way leaves the course in
+        # place and the DELETE can simply be repeated
+        delete_course_enrollments(client, course_id)
         client.delete(course_key)
+        forget_course(course_id)
         
         return '', 204
         
+    except BackendUnavailable:
+        raise
     except Exception as e:
-        print(f"Error in delete_course: {e}")
+        logger.exception("Error in delete_course")
         return jsonify({"Error": "Internal server error"}), 500
 
 @course_bp.route('/courses/<int:course_id>/students', methods=['PATCH'])
 @requires_auth
+@rate_limited('enrollment')
 def update_enrollment(payload, course_id):
     """Update enrollment in a course - Admin or course instructor only"""
     try:
-        client = datastore.Client()
+        client = get_datastore_client()
         
         # Get requesting user
-        query = client.query(kind='users')
-        query.add_filter('sub', '=', payload['sub'])
-        users = list(query.fetch())
+        requesting_user = get_user_by_sub(client, payload['sub'])
         
-        if not users:
+        if not requesting_user:
             return jsonify({"Error": "You don't have permission on this resource"}), 403
         
-        requesting_user = users[0]
-        
-        # Check if course exists
-        course_key = client.key('courses', course_id)
-        course = client.get(course_key)
+        # Check if course exists; a strong read, since it decides permission
+        course = client.get(client.key('courses', course_id))
         
         if not course:
             return jsonify({"Error": "You don't have permission on this resource"}), 403
@@ -248,11 +264,13 @@ def update_enrollment(payload, course_id):
         # Check if all IDs are valid students
         for student_id in all_students:
             if student_id:  # Skip empty values
-                student_key = client.key('users', student_id)
-                student = client.get(student_key)
+                student = get_user_entity(client, student_id)
                 if not student or student['role'] != 'student':
                     return jsonify({"Error": "Enrollment data is invalid"}), 409
         
+        puts = []
+        deletes = []
+        
         # Add students (create enrollment entities)
         for student_id in add_students:
             if student_id:  # Skip empty values
@@ -264,12 +282,12 @@ def update_enrollment(payload, course_id):
                 
                 if not existing:
                     enrollment_key = client.key('enrollments')
-                    enrollment = datastore.Entity(key=enrollment_key)
+                    enrollment = new_entity(enrollment_key)
                     enrollment.update({
                         'course_id': course_id,
                         'student_id': student_id
                     })
-                    client.put(enrollment)
+                    puts.append(enrollment)
         
         # Remove students (delete enrollment entities)
         for student_id in remove_students:
@@ -280,12 +298,17 @@ def update_enrollment(payload, course_id):
                 enrollments = list(enrollment_query.fetch())
                 
                 for enrollment in enrollments:
-                    client.delete(enrollment.key)
+                    deletes.append(enrollment.key)
+        
+        # Respond only once the writes are committed
+        commit_enrollment_writes(client, puts, deletes)
         
         return '', 200
         
+    except BackendUnavailable:
+        raise
     except Exception as e:
-        print(f"Error in update_enrollment: {e}")
+        logger.warning("Error in update_enrollment: %s", e)
         return jsonify({"Error": "Enrollment data is invalid"}), 409
 
 @course_bp.route('/courses/<int:course_id>/students', methods=['GET'])
@@ -293,21 +316,16 @@ def update_enrollment(payload, course_id):
 def get_enrollment(payload, course_id):
     """Get enrollment for a course - Admin or course instructor only"""
     try:
-        client = datastore.Client()
+        client = get_datastore_client()
         
         # Get requesting user
-        query = client.query(kind='users')
-        query.add_filter('sub', '=', payload['sub'])
-        users = list(query.fetch())
+        requesting_user = get_user_by_sub(client, payload['sub'])
         
-        if not users:
+        if not requesting_user:
             return jsonify({"Error": "You don't have permission on this resource"}), 403
         
-        requesting_user = users[0]
-        
-        # Check if course exists
-        course_key = client.key('courses', course_id)
-        course = client.get(course_key)
+        # Check if course exists; a strong read, since it decides permission
+        course = client.get(client.key('courses', course_id))
         
         if not course:
             return jsonify({"Error": "You don't have permission on this resource"}), 403
@@ -325,6 +343,8 @@ def get_enrollment(payload, course_id):
         
         return jsonify(student_ids), 200
         
+    except BackendUnavailable:
+        raise
     except Exception as e:
-        print(f"Error in get_enrollment: {e}")
+        logger.exception("Error in get_enrollment")
         return jsonify({"Error": "Internal server error"}), 500
\ No newline at end of file
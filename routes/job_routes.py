@@ -0,0 +1,13 @@
+from flask import Blueprint, jsonify
+from utils.jobs import get_job_queue
+from utils.tenancy import current_tenant
+
+job_bp = Blueprint('jobs', __name__)
+
+@job_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get the status of a background job - Unprotected, job ids are unguessable"""
+    job = get_job_queue().get(job_id)
+    if not job or job.tenant != current_tenant().id:
+        return jsonify({"Error": "Not found"}), 404
+    return jsonify(job.to_dict()), 200
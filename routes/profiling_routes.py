@@ -0,0 +1,86 @@
+from flask import Blueprint, request, jsonify, Response
+from utils.auth import requires_auth
+from utils.datastore_client import get_datastore_client, get_user_by_sub
+from utils.profiling import load_profile, profiling_enabled, sample_stacks, tracemalloc_top
+import tracemalloc
+
+profiling_bp = Blueprint('profiling', __name__)
+
+MAX_SAMPLE_SECONDS = 30
+
+@profiling_bp.before_request
+def check_enabled():
+    """Hide the profiling routes unless profiling is switched on"""
+    if not profiling_enabled():
+        return jsonify({"Error": "Not found"}), 404
+
+def is_admin(payload):
+    """Check the caller is an admin"""
+    user = get_user_by_sub(get_datastore_client(), payload['sub'])
+    return bool(user) and user['role'] == 'admin'
+
+@profiling_bp.route('/admin/profiles/<profile_id>', methods=['GET'])
+@requires_auth
+def get_profile(payload, profile_id):
+    """Download a request profile - Admin only"""
+    if not is_admin(payload):
+        return jsonify({"Error": "You don't have permission on this resource"}), 403
+
+    data = load_profile(profile_id)
+    if data is None:
+        return jsonify({"Error": "Not found"}), 404
+
+    return Response(data, mimetype='application/octet-stream', headers={
+        "Content-Disposition": f"attachment; filename=profile-{profile_id}.pstats"
+    })
+
+@profiling_bp.route('/admin/profiler/sample', methods=['POST'])
+@requires_auth
+def sample(payload):
+    """Sample all threads for ?seconds= (default 5) at ?interval= and return collapsed stacks - Admin only"""
+    if not is_admin(payload):
+        return jsonify({"Error": "You don't have permission on this resource"}), 403
+
+    try:
+        seconds = float(request.args.get('seconds', 5))
+        interval = float(request.args.get('interval', 0.01))
+    except ValueError:
+        return jsonify({"Error": "The request body is invalid"}), 400
+    if not 0 < seconds <= MAX_SAMPLE_SECONDS or not 0.001 <= interval <= 1:
+        return jsonify({"Error": "The request body is invalid"}), 400
+
+    return Response(sample_stacks(seconds, interval), mimetype='text/plain', headers={
+        "Content-Disposition": "attachment; filename=profile.collapsed"
+    })
+
+@profiling_bp.route('/admin/tracemalloc', methods=['POST'])
+@requires_auth
+def start_tracemalloc(payload):
+    """Start tracing allocations with ?frames= of traceback - Admin only"""
+    if not is_admin(payload):
+        return jsonify({"Error": "You don't have permission on this resource"}), 403
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(max(1, request.args.get('frames', 1, type=int)))
+    return jsonify({"tracing": True}), 200
+
+@profiling_bp.route('/admin/tracemalloc', methods=['GET'])
+@requires_auth
+def get_tracemalloc(payload):
+    """Snapshot the top ?limit= allocation sites - Admin only"""
+    if not is_admin(payload):
+        return jsonify({"Error": "You don't have permission on this resource"}), 403
+
+    if not tracemalloc.is_tracing():
+        return jsonify({"Error": "Not found"}), 404
+    return jsonify(tracemalloc_top(request.args.get('limit', 25, type=int))), 200
+
+@profiling_bp.route('/admin/tracemalloc', methods=['DELETE'])
+@requires_auth
+def stop_tracemalloc(payload):
+    """Stop tracing allocations - Admin only"""
+    if not is_admin(payload):
+        return jsonify({"Error": "You don't have permission on this resource"}), 403
+
+    tracemalloc.stop()
+    return '', 204
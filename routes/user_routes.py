@@ -1,15 +1,34 @@
-from flask import Blueprint, request, jsonify, send_file
-from google.cloud import datastore
-from google.cloud import storage
+from flask import Blueprint, request, jsonify, send_file, redirect
+from models.course import Course
 from utils.auth import requires_auth
+from utils.rate_limit import rate_limited
+from utils.deadline import BackendUnavailable, call_backend
+from utils.datastore_client import get_datastore_client, get_user_by_sub, get_user_entity
+from utils.read_policy import read_options
+from utils.storage import avatar_blob_name, get_signing_kwargs, get_storage_client
+from utils.tenancy import TenantCache
+from datetime import timedelta
 import io
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 user_bp = Blueprint('users', __name__)
 
-def get_storage_client():
-    """Get Cloud Storage client"""
-    return storage.Client()
+# AVATAR_DELIVERY=redirect makes GET /users/<id>/avatar redirect to a signed
+# URL instead of proxying the bytes; AVATAR_URL_SIGNED=true makes get_user
+# return that signed URL as avatar_url
+SIGNED_URL_TTL = int(os.environ.get('SIGNED_URL_TTL', 900))
+SIGNED_URL_REFRESH_MARGIN = 60
+
+# get_user makes one attempt of at most this long to learn whether there is an
+# avatar; retrying would hold up the profile for several of them while Storage fails
+AVATAR_CHECK_TIMEOUT = float(os.environ.get('AVATAR_CHECK_TIMEOUT', 1.0))
+
+# Signed URLs by user id, reused until shortly before they expire. Another
+# worker may have deleted the avatar since, so existence is still checked.
+_signed_urls = TenantCache('signed_urls')
 
 def upload_avatar_to_storage(user_id, file_content):
     """Upload avatar to Cloud Storage"""
@@ -17,9 +36,11 @@ def upload_avatar_to_storage(user_id, file_content):
     bucket_name = os.environ.get('BUCKET_NAME', 'tume-tarpaulin-avatars')
     bucket = client.bucket(bucket_name)
     
-    blob_name = f"avatars/{user_id}.png"
+    blob_name = avatar_blob_name(user_id)
     blob = bucket.blob(blob_name)
-    blob.upload_from_string(file_content, content_type='image/png')
+    call_backend('storage', blob.upload_from_string, file_content, content_type='image/png',
+                 trace_attributes={"blob": blob_name})
+    _signed_urls.delete(user_id)
     
     return blob_name
 
@@ -29,11 +50,11 @@ def get_avatar_from_storage(user_id):
     bucket_name = os.environ.get('BUCKET_NAME', 'tume-tarpaulin-avatars')
     bucket = client.bucket(bucket_name)
     
-    blob_name = f"avatars/{user_id}.png"
+    blob_name = avatar_blob_name(user_id)
     blob = bucket.blob(blob_name)
     
-    if blob.exists():
-        return blob.download_as_bytes()
+    if call_backend('storage', blob.exists, trace_attributes={"blob": blob_name}):
+        return call_backend('storage', blob.download_as_bytes, trace_attributes={"blob": blob_name})
     return None
 
 def delete_avatar_from_storage(user_id):
@@ -42,46 +63,115 @@ def delete_avatar_from_storage(user_id):
     bucket_name = os.environ.get('BUCKET_NAME', 'tume-tarpaulin-avatars')
     bucket = client.bucket(bucket_name)
     
-    blob_name = f"avatars/{user_id}.png"
+    blob_name = avatar_blob_name(user_id)
     blob = bucket.blob(blob_name)
     
-    if blob.exists():
-        blob.delete()
+    _signed_urls.delete(user_id)
+    if call_backend('storage', blob.exists, trace_attributes={"blob": blob_name}):
+        call_backend('storage', blob.delete, trace_attributes={"blob": blob_name})
         return True
     return False
 
-def avatar_exists(user_id):
+def avatar_exists(user_id, timeout_cap=None, max_attempts=None):
     """Check if avatar exists in Cloud Storage"""
     client = get_storage_client()
     bucket_name = os.environ.get('BUCKET_NAME', 'tume-tarpaulin-avatars')
     bucket = client.bucket(bucket_name)
     
-    blob_name = f"avatars/{user_id}.png"
+    blob_name = avatar_blob_name(user_id)
+    blob = bucket.blob(blob_name)
+    
+    return call_backend('storage', blob.exists, timeout_cap=timeout_cap, max_attempts=max_attempts,
+                        trace_attributes={"blob": blob_name})
+
+def get_avatar_signed_url(user_id, timeout_cap=None, max_attempts=None):
+    """Get a short-lived V4 signed URL for the avatar, or None if there is no avatar"""
+    client = get_storage_client()
+    bucket_name = os.environ.get('BUCKET_NAME', 'tume-tarpaulin-avatars')
+    bucket = client.bucket(bucket_name)
+    
+    blob_name = avatar_blob_name(user_id)
     blob = bucket.blob(blob_name)
     
-    return blob.exists()
+    if not call_backend('storage', blob.exists, timeout_cap=timeout_cap, max_attempts=max_attempts,
+                        trace_attributes={"blob": blob_name}):
+        _signed_urls.delete(user_id)
+        return None
+    
+    url = _signed_urls.get(user_id)
+    if url:
+        return url
+    
+    # Signing may refresh the access token and call the IAM API
+    def sign(timeout=None):
+        return blob.generate_signed_url(
+            version='v4',
+            expiration=timedelta(seconds=SIGNED_URL_TTL),
+            method='GET',
+            **get_signing_kwargs(client, timeout)
+        )
+    url = call_backend('storage', sign, google_retry=False, timeout_cap=timeout_cap, max_attempts=max_attempts,
+                       trace_attributes={"blob": blob_name})
+    # Hand out cached URLs only while they have some life left
+    _signed_urls.set(user_id, url, SIGNED_URL_TTL - SIGNED_URL_REFRESH_MARGIN)
+    return url
+
+def course_to_dict(course):
+    """Build the same course object GET /courses/<id> returns"""
+    return Course(
+        id=course.key.id,
+        subject=course.get('subject'),
+        number=course.get('number'),
+        title=course.get('title'),
+        term=course.get('term'),
+        instructor_id=course.get('instructor_id'),
+        self_url=f"{request.host_url.rstrip('/')}/courses/{course.key.id}"
+    ).to_dict()
 
-def get_user_courses(user_id, role, datastore_client):
-    """Get courses for instructor or student"""
+def get_user_courses(user_id, role, datastore_client, expand=False):
+    """
+    Get courses for instructor or student, as URLs or, with expand, as full
+    course objects. Either way this is at most two Datastore calls.
+    """
     courses = []
+    options = read_options('user_courses')
     
     if role == 'instructor':
-        # Get courses where this user is the instructor
+        # Get courses where this user is the instructor; URLs only need keys
         course_query = datastore_client.query(kind='courses')
         course_query.add_filter('instructor_id', '=', user_id)
-        user_courses = list(course_query.fetch())
+        if not expand:
+            course_query.keys_only()
+        user_courses = list(course_query.fetch(**options))
         
         for course in user_courses:
-            courses.append(f"{request.host_url.rstrip('/')}/courses/{course.key.id}")
+            if expand:
+                courses.append(course_to_dict(course))
+            else:
+                courses.append(f"{request.host_url.rstrip('/')}/courses/{course.key.id}")
     
     elif role == 'student':
         # Get enrollments for this student
         enrollment_query = datastore_client.query(kind='enrollments')
         enrollment_query.add_filter('student_id', '=', user_id)
-        enrollments = list(enrollment_query.fetch())
-        
-        for enrollment in enrollments:
-            courses.append(f"{request.host_url.rstrip('/')}/courses/{enrollment['course_id']}")
+        enrollments = list(enrollment_query.fetch(**options))
+        
+        if not expand:
+            for enrollment in enrollments:
+                courses.append(f"{request.host_url.rstrip('/')}/courses/{enrollment['course_id']}")
+            return courses
+        
+        # Fetch every enrolled course in one batched lookup
+        course_ids = list(dict.fromkeys(enrollment['course_id'] for enrollment in enrollments))
+        if not course_ids:
+            return courses
+        keys = [datastore_client.key('courses', course_id) for course_id in course_ids]
+        found = {course.key.id: course for course in datastore_client.get_multi(keys, **options)}
+        
+        # Keep enrollment order; skip enrollments whose course is being deleted
+        for course_id in course_ids:
+            if course_id in found:
+                courses.append(course_to_dict(found[course_id]))
     
     return courses
 
@@ -90,19 +180,17 @@ def get_user_courses(user_id, role, datastore_client):
 def get_all_users(payload):
     """Get all users - Admin only"""
     try:
-        client = datastore.Client()
+        client = get_datastore_client()
         
         # Check if user is admin
-        query = client.query(kind='users')
-        query.add_filter('sub', '=', payload['sub'])
-        users = list(query.fetch())
+        requesting_user = get_user_by_sub(client, payload['sub'])
         
-        if not users or users[0]['role'] != 'admin':
+        if not requesting_user or requesting_user['role'] != 'admin':
             return jsonify({"Error": "You don't have permission on this resource"}), 403
         
         # Get all users
         query = client.query(kind='users')
-        all_users = list(query.fetch())
+        all_users = list(query.fetch(**read_options('users_list')))
         
         result = []
         for user in all_users:
@@ -113,8 +201,10 @@ def get_all_users(payload):
             })
         
         return jsonify(result), 200
+    except BackendUnavailable:
+        raise
     except Exception as e:
-        print(f"Error in get_all_users: {e}")
+        logger.exception("Error in get_all_users")
         return jsonify({"Error": "Internal server error"}), 500
 
 @user_bp.route('/users/<int:user_id>', methods=['GET'])
@@ -122,21 +212,16 @@ def get_all_users(payload):
 def get_user(payload, user_id):
     """Get a specific user"""
     try:
-        client = datastore.Client()
+        client = get_datastore_client()
         
         # Get the requesting user
-        query = client.query(kind='users')
-        query.add_filter('sub', '=', payload['sub'])
-        requesting_users = list(query.fetch())
+        requesting_user = get_user_by_sub(client, payload['sub'])
         
-        if not requesting_users:
+        if not requesting_user:
             return jsonify({"Error": "You don't have permission on this resource"}), 403
         
-        requesting_user = requesting_users[0]
-        
         # Get the target user
-        user_key = client.key('users', user_id)
-        target_user = client.get(user_key)
+        target_user = get_user_entity(client, user_id)
         
         if not target_user:
             return jsonify({"Error": "You don't have permission on this resource"}), 403
@@ -152,21 +237,35 @@ def get_user(payload, user_id):
             "sub": target_user['sub']
         }
         
-        # Add avatar_url if avatar exists
-        if avatar_exists(user_id):
-            result["avatar_url"] = f"{request.host_url.rstrip('/')}/users/{user_id}/avatar"
-        
-        # Add courses for instructors and students
+        # Add avatar_url if avatar exists; if Storage is failing, leave it
+        # out rather than hold up the rest of the profile. A signed URL grants
+        # access by itself, so only the owner gets one, as with GET /users/<id>/avatar
+        try:
+            signed = os.environ.get('AVATAR_URL_SIGNED', 'false').lower() == 'true'
+            if signed and requesting_user.key.id == user_id:
+                avatar_url = get_avatar_signed_url(user_id, timeout_cap=AVATAR_CHECK_TIMEOUT, max_attempts=1)
+                if avatar_url:
+                    result["avatar_url"] = avatar_url
+            elif avatar_exists(user_id, timeout_cap=AVATAR_CHECK_TIMEOUT, max_attempts=1):
+                result["avatar_url"] = f"{request.host_url.rstrip('/')}/users/{user_id}/avatar"
+        except BackendUnavailable as e:
+            logger.warning("Omitting avatar_url for user %s: %s", user_id, e)
+        
+        # Add courses for instructors and students, as full objects with ?expand=courses
         if target_user['role'] in ['instructor', 'student']:
-            result["courses"] = get_user_courses(user_id, target_user['role'], client)
+            expand = 'courses' in request.args.get('expand', '').split(',')
+            result["courses"] = get_user_courses(user_id, target_user['role'], client, expand=expand)
         
         return jsonify(result), 200
+    except BackendUnavailable:
+        raise
     except Exception as e:
-        print(f"Error in get_user: {e}")
+        logger.exception("Error in get_user")
         return jsonify({"Error": "Internal server error"}), 500
 
 @user_bp.route('/users/<int:user_id>/avatar', methods=['POST'])
 @requires_auth
+@rate_limited('avatar')
 def create_update_avatar(payload, user_id):
     """Create or update user avatar"""
     try:
@@ -179,14 +278,12 @@ def create_update_avatar(payload, user_id):
             return jsonify({"Error": "The request body is invalid"}), 400
         
         # SECOND: Check authentication and permissions (after 400 checks)
-        client = datastore.Client()
+        client = get_datastore_client()
         
         # Check if user owns this profile
-        query = client.query(kind='users')
-        query.add_filter('sub', '=', payload['sub'])
-        users = list(query.fetch())
+        requesting_user = get_user_by_sub(client, payload['sub'])
         
-        if not users or users[0].key.id != user_id:
+        if not requesting_user or requesting_user.key.id != user_id:
             return jsonify({"Error": "You don't have permission on this resource"}), 403
         
         # Upload the file to Cloud Storage
@@ -197,25 +294,35 @@ def create_update_avatar(payload, user_id):
             "avatar_url": f"{request.host_url.rstrip('/')}/users/{user_id}/avatar"
         }), 200
         
+    except BackendUnavailable:
+        raise
     except Exception as e:
-        print(f"Error in create_update_avatar: {e}")
+        logger.warning("Error in create_update_avatar: %s", e)
         return jsonify({"Error": "The request body is invalid"}), 400
 
 @user_bp.route('/users/<int:user_id>/avatar', methods=['GET'])
-@requires_auth 
+@requires_auth
+@rate_limited('avatar')
 def get_user_avatar(payload, user_id):
     """Get user avatar"""
     try:
-        client = datastore.Client()
+        client = get_datastore_client()
         
         # Check permissions
-        query = client.query(kind='users')
-        query.add_filter('sub', '=', payload['sub'])
-        users = list(query.fetch())
+        requesting_user = get_user_by_sub(client, payload['sub'])
         
-        if not users or users[0].key.id != user_id:
+        if not requesting_user or requesting_user.key.id != user_id:
             return jsonify({"Error": "You don't have permission on this resource"}), 403
         
+        # Send the client straight to Cloud Storage
+        if os.environ.get('AVATAR_DELIVERY', 'proxy') == 'redirect':
+            avatar_url = get_avatar_signed_url(user_id)
+            if avatar_url is None:
+                return jsonify({"Error": "Not found"}), 404
+            response = redirect(avatar_url, 302)
+            response.headers['Cache-Control'] = 'private, no-store'
+            return response
+        
         # Get avatar from Cloud Storage
         avatar_data = get_avatar_from_storage(user_id)
         
@@ -229,23 +336,24 @@ def get_user_avatar(payload, user_id):
             as_attachment=False
         )
         
+    except BackendUnavailable:
+        raise
     except Exception as e:
-        print(f"Error in get_user_avatar: {e}")
+        logger.exception("Error in get_user_avatar")
         return jsonify({"Error": "Internal server error"}), 500
 
 @user_bp.route('/users/<int:user_id>/avatar', methods=['DELETE'])
 @requires_auth
+@rate_limited('avatar')
 def delete_user_avatar(payload, user_id):
     """Delete user avatar"""
     try:
-        client = datastore.Client()
+        client = get_datastore_client()
         
         # Check permissions
-        query = client.query(kind='users')
-        query.add_filter('sub', '=', payload['sub'])
-        users = list(query.fetch())
+        requesting_user = get_user_by_sub(client, payload['sub'])
         
-        if not users or users[0].key.id != user_id:
+        if not requesting_user or requesting_user.key.id != user_id:
             return jsonify({"Error": "You don't have permission on this resource"}), 403
         
         # Check if avatar exists and delete it
@@ -254,6 +362,8 @@ def delete_user_avatar(payload, user_id):
         else:
             return jsonify({"Error": "Not found"}), 404
         
+    except BackendUnavailable:
+        raise
     except Exception as e:
-        print(f"Error in delete_user_avatar: {e}")
+        logger.exception("Error in delete_user_avatar")
         return jsonify({"Error": "Internal server error"}), 500
\ No newline at end of file
@@ -0,0 +1,60 @@
+"""
+Benchmark of response compression on GET /courses sized bodies.
+
+Prints the compressed size and CPU time per response for gzip and, when the
+optional brotli package is installed, brotli, at the configured levels.
+Run from the repository root: python tests/bench_compression.py
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.compression import BrotliEncoder, GzipEncoder, get_brotli
+
+def courses_body(count):
+    """A GET /courses response body with count courses"""
+    courses = [{
+        "id": 5629499534213120 + i,
+        "subject": "CS",
+        "number": 400 + i % 100,
+        "title": f"Cloud Application Development {i}",
+        "term": "fall-24",
+        "instructor_id": 5644406560391168,
+        "self": f"https://tarpaulin.example.com/courses/{5629499534213120 + i}"
+    } for i in range(count)]
+    return json.dumps({
+        "courses": courses,
+        "next": f"https://tarpaulin.example.com/courses?limit={count}&offset={count}"
+    }).encode('utf-8')
+
+def measure(make_encoder, data, rounds):
+    """Return (compressed size, CPU milliseconds per response)"""
+    start = time.process_time()
+    for _ in range(rounds):
+        encoder = make_encoder()
+        compressed = encoder.compress(data) + encoder.finish()
+    return len(compressed), (time.process_time() - start) * 1000 / rounds
+
+def main():
+    gzip_level = int(os.environ.get('GZIP_LEVEL', 6))
+    brotli_quality = int(os.environ.get('BROTLI_QUALITY', 4))
+    encoders = [(f"gzip-{gzip_level}", lambda: GzipEncoder(gzip_level))]
+    if get_brotli() is not None:
+        encoders.append((f"br-{brotli_quality}", lambda: BrotliEncoder(brotli_quality)))
+    else:
+        print("brotli is not installed, measuring gzip only")
+
+    for limit in (10, 100, 1000):
+        data = courses_body(limit)
+        rounds = max(20, 20000 // limit)
+        results = []
+        for name, make_encoder in encoders:
+            size, cpu_ms = measure(make_encoder, data, rounds)
+            results.append(f"{name:>7} {size / len(data):4.0%} {cpu_ms:6.2f} ms")
+        print(f"{len(data) / 1024:6.1f} KB (limit={limit:<4})  " + "   ".join(results))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""Shared fixtures: the app wired to in-memory Datastore and Cloud Storage stand-ins"""
+from contextlib import contextmanager
+import itertools
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jwt
+import pytest
+from google.auth.credentials import Signing
+from google.cloud.datastore import Entity, Key
+
+class StubQuery:
+    """Equality filters, ordering, limit/offset and keys_only over a StubDatastore"""
+    def __init__(self, client, kind):
+        self.client = client
+        self.kind = kind
+        self.filters = []
+        self.order = []
+
+    def add_filter(self, prop, op, value):
+        self.filters.append((prop, value))
+
+    def keys_only(self):
+        pass
+
+    def fetch(self, limit=None, offset=0, timeout=None, retry=None, **kwargs):
+        self.client.calls.append(('query', self.kind))
+        results = [
+            entity for (namespace, kind, _), entity in list(self.client.store.items())
+            if namespace == self.client.namespace and kind == self.kind
+            and all(entity.get(prop) == value for prop, value in self.filters)
+        ]
+        for prop in reversed(self.order):
+            results.sort(key=lambda entity: entity.get(prop.lstrip('-')), reverse=prop.startswith('-'))
+        results = results[offset or 0:]
+        return iter(results if limit is None else results[:limit])
+
+class StubDatastore:
+    """In-memory datastore.Client: get/put/delete (single and multi) and queries"""
+    def __init__(self, store, calls, namespace=None):
+        self.store = store
+        self.calls = calls
+        self.namespace = namespace
+        self.project = 'test'
+        self._ids = itertools.count(1000)
+        self._lock = threading.Lock()
+        self._transaction_lock = threading.RLock()
+        self._transaction = threading.local()
+
+    def key(self, kind, id=None):
+        if id is None:
+            return Key(kind, project=self.project, namespace=self.namespace)
+        return Key(kind, id, project=self.project, namespace=self.namespace)
+
+    def query(self, kind):
+        return StubQuery(self, kind)
+
+    @contextmanager
+    def transaction(self):
+        # Like Datastore, writes apply only when the transaction commits;
+        # serializing transactions is enough isolation for a stand-in
+        with self._transaction_lock:
+            self._transaction.writes = []
+            try:
+                yield
+                for write in self._transaction.writes:
+                    write()
+            finally:
+                self._transaction.writes = None
+
+    def _write(self, write, *args):
+        writes = getattr(self._transaction, 'writes', None)
+        if writes is None:
+            write(*args)
+        else:
+            writes.append(lambda: write(*args))
+
+    def _id(self, key):
+        return (self.namespace, key.kind, key.id_or_name)
+
+    def get(self, key, timeout=None, retry=None, **kwargs):
+        self.calls.append(('get', key.kind))
+        return self.store.get(self._id(key))
+
+    def get_multi(self, keys, timeout=None, retry=None, **kwargs):
+        self.calls.append(('get_multi', len(keys)))
+        return [self.store[self._id(key)] for key in keys if self._id(key) in self.store]
+
+    def put(self, entity, timeout=None, retry=None):
+        self.calls.append(('put', entity.key.kind))
+        self._write(self._put, entity)
+
+    def put_multi(self, entities, timeout=None, retry=None):
+        self.calls.append(('put_multi', len(entities)))
+        for entity in entities:
+            self._write(self._put, entity)
+
+    def _put(self, entity):
+        with self._lock:
+            if entity.key.is_partial:
+                entity.key = entity.key.completed_key(next(self._ids))
+            self.store[self._id(entity.key)] = entity
+
+    def delete(self, key, timeout=None, retry=None):
+        self.calls.append(('delete', key.kind))
+        self._write(self.store.pop, self._id(key), None)
+
+    def delete_multi(self, keys, timeout=None, retry=None):
+        self.calls.append(('delete_multi', len(keys)))
+        paths = [key.flat_path for key in keys]
+        if len(set(paths)) != len(paths):
+            # Datastore rejects a commit with several mutations of one entity
+            raise ValueError("A non-transactional commit may not contain multiple mutations affecting the same entity")
+        for key in keys:
+            self._write(self.store.pop, self._id(key), None)
+
+class StubBlob:
+    """Blob with exists/upload/download/delete over a dict, signed by the real V4 signer"""
+    def __init__(self, client, bucket_name, name):
+        self.client = client
+        self.blobs = client.blobs
+        self.bucket_name = bucket_name
+        self.name = name
+
+    def exists(self, timeout=None, retry=None):
+        return self.name in self.blobs
+
+    def upload_from_string(self, data, content_type=None, timeout=None, retry=None):
+        self.blobs[self.name] = data
+
+    def download_as_bytes(self, timeout=None, retry=None):
+        return self.blobs[self.name]
+
+    def delete(self, timeout=None, retry=None):
+        del self.blobs[self.name]
+
+    def generate_signed_url(self, **kwargs):
+        # Signing is local to the credentials, so the real code path runs offline
+        from google.cloud.storage import Blob, Bucket
+        return Blob(self.name, Bucket(None, self.bucket_name)).generate_signed_url(client=self.client, **kwargs)
+
+class StubBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def blob(self, name):
+        return StubBlob(self.client, self.name, name)
+
+class StubSigningCredentials(Signing):
+    """Credentials that sign locally, like a service account key"""
+    signer = None
+    signer_email = 'signer@test.iam.gserviceaccount.com'
+
+    def sign_bytes(self, message):
+        return b'signature'
+
+class StubStorage:
+    """Cloud Storage client whose buckets all share one dict of blobs"""
+    def __init__(self, blobs, credentials=None):
+        self.blobs = blobs
+        self._credentials = credentials or StubSigningCredentials()
+
+    def bucket(self, name):
+        return StubBucket(self, name)
+
+def token(sub):
+    """Authorization header for a caller"""
+    return {"Authorization": "Bearer " + jwt.encode({"sub": sub}, 'k' * 32, algorithm='HS256')}
+
+@pytest.fixture
+def datastore(monkeypatch):
+    """Shared entity store, seeded with an admin, an instructor, two students and two courses"""
+    from google.cloud import datastore as gcd
+    from utils.datastore_client import reset_datastore_client
+
+    store, calls = {}, []
+    monkeypatch.setattr(gcd, 'Client', lambda namespace=None, **kwargs: StubDatastore(store, calls, namespace))
+    reset_datastore_client()
+
+    client = StubDatastore(store, calls)
+    def add(kind, id, **props):
+        entity = Entity(key=client.key(kind, id))
+        entity.update(props)
+        store[(None, kind, id)] = entity
+    add('users', 1, role='admin', sub='admin')
+    add('users', 2, role='instructor', sub='instructor')
+    add('users', 3, role='student', sub='student1')
+    add('users', 4, role='student', sub='student2')
+    add('courses', 10, subject='CS', number=493, title='Cloud', term='fall-24', instructor_id=2)
+    add('courses', 11, subject='AB', number=101, title='Intro', term='fall-24', instructor_id=2)
+    add('enrollments', 20, student_id=3, course_id=10)
+
+    client.add = add
+    yield client
+    reset_datastore_client()
+
+@pytest.fixture
+def storage(monkeypatch):
+    """Blob contents by object name"""
+    from google.cloud import storage as gcs
+    from utils.storage import reset_storage_client
+
+    blobs = {}
+    monkeypatch.setattr(gcs, 'Client', lambda **kwargs: StubStorage(blobs))
+    reset_storage_client()
+    yield blobs
+    reset_storage_client()
+
+@pytest.fixture
+def make_app(datastore, storage, monkeypatch):
+    """Build a fresh app; set environment variables before calling it"""
+    from routes import user_routes
+    from utils import circuit_breaker, datastore_client
+    from utils.tenancy import TenantCache
+    monkeypatch.setenv('LOG_LEVEL', 'CRITICAL')
+    monkeypatch.setenv('RATE_LIMIT_ENABLED', 'false')
+    monkeypatch.setattr(datastore_client, '_stale_courses', TenantCache('stale_courses', max_entries=1000))
+    monkeypatch.setattr(user_routes, '_signed_urls', TenantCache('signed_urls'))
+    monkeypatch.setattr(circuit_breaker, '_breakers', {})
+    def make():
+        from main import create_app
+        return create_app()
+    return make
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
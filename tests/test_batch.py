@@ -0,0 +1,109 @@
+from conftest import token
+from utils import tracing
+from utils.deadline import deadline_var
+import pytest
+
+@pytest.fixture
+def exporter(monkeypatch):
+    monkeypatch.setenv('TRACING_SAMPLE_RATE', '1')
+    exporter = tracing.InMemoryExporter()
+    tracing.set_exporter(exporter)
+    yield exporter
+    tracing.set_exporter(None)
+
+@pytest.mark.parametrize('items', [
+    [{"method": "GET", "path": "/courses/10"}],
+    [{"method": "PATCH", "path": "/courses/10/students", "body": {"add": [4], "remove": []}}],
+    [{"method": "GET", "path": "/courses/10"}, {"method": "GET", "path": "/courses/11"}],
+])
+def test_batch_exports_its_trace(exporter, make_app, items):
+    client = make_app().test_client()
+    response = client.post('/batch', json={"requests": items}, headers=token('admin'))
+    assert response.status_code == 200
+    assert all(r['status'] == 200 for r in response.get_json()['responses'])
+
+    assert len(exporter.traces) == 1
+    spans = exporter.traces[0]
+    root = [span for span in spans if span['parent_id'] is None]
+    assert [span['name'] for span in root] == ['POST /batch']
+    sub_requests = [span for span in spans if span['parent_id'] == root[0]['span_id'] and span['name'] != 'requires_auth']
+    assert len([span for span in sub_requests if span['name'].startswith(('GET', 'PATCH'))]) == len(items)
+
+    # Nothing is left behind on the thread for the next request
+    assert tracing.current_span_var.get() is None
+    assert deadline_var.get() is None
+
+def test_later_requests_start_their_own_trace(exporter, make_app):
+    client = make_app().test_client()
+    client.post('/batch', json={"requests": [{"method": "GET", "path": "/courses/10"}]}, headers=token('admin'))
+    client.get('/courses/11')
+    assert len(exporter.traces) == 2
+    assert exporter.traces[0][0]['trace_id'] != exporter.traces[1][0]['trace_id']
+
+def test_each_item_gets_its_own_status(client, datastore):
+    items = [
+        {"method": "PATCH", "path": "/courses/10/students", "body": {"add": [4], "remove": []}},
+        {"method": "GET", "path": "/courses/10/students"},
+        {"method": "GET", "path": "/courses/999"},
+        {"method": "PATCH", "path": "/courses/10/students", "body": {"add": [1], "remove": []}},
+    ]
+    response = client.post('/batch', json={"requests": items}, headers=token('admin'))
+
+    assert response.status_code == 200
+    responses = response.get_json()['responses']
+    assert [r['status'] for r in responses] == [200, 200, 404, 409]
+    # Writes run in order, so the GET after the PATCH sees its enrollment
+    assert sorted(responses[1]['body']) == [3, 4]
+    assert responses[2]['body'] == {"Error": "Not found"}
+
+def test_an_item_that_raises_does_not_fail_the_batch(make_app, datastore):
+    app = make_app()
+    def boom():
+        raise RuntimeError("boom")
+    app.add_url_rule('/boom', 'boom', boom)
+
+    items = [
+        {"method": "PATCH", "path": "/courses/10/students", "body": {"add": [4], "remove": []}},
+        {"method": "GET", "path": "/boom"},
+        {"method": "GET", "path": "/courses/10"},
+    ]
+    response = app.test_client().post('/batch', json={"requests": items}, headers=token('admin'))
+
+    assert response.status_code == 200
+    responses = response.get_json()['responses']
+    assert [r['status'] for r in responses] == [200, 500, 200]
+    assert responses[1]['body'] == {"Error": "Internal server error"}
+    assert any(e.get('student_id') == 4 for (_, kind, _), e in datastore.store.items() if kind == 'enrollments')
+
+def test_the_batch_authenticates_once(client, datastore, monkeypatch):
+    from utils import auth
+    decoded = []
+    verify = auth.verify_decode_jwt
+    monkeypatch.setattr(auth, 'verify_decode_jwt', lambda t: decoded.append(t) or verify(t))
+    items = [{"method": "GET", "path": "/courses/10/students"}] * 3 + [{"method": "GET", "path": "/users/1"}]
+
+    response = client.post('/batch', json={"requests": items}, headers=token('admin'))
+
+    assert [r['status'] for r in response.get_json()['responses']] == [200, 200, 200, 200]
+    assert len(decoded) == 1
+    # The caller is looked up once for the batch, not once per item
+    assert datastore.calls.count(('query', 'users')) == 1
+
+def test_unauthenticated_batch_is_rejected(client):
+    response = client.post('/batch', json={"requests": [{"method": "GET", "path": "/courses/10"}]})
+    assert response.status_code == 401
+
+@pytest.mark.parametrize('path', ['/batch', '/batch?x=1'])
+def test_nested_batches_are_rejected(client, path):
+    items = [{"method": "POST", "path": path, "body": {"requests": []}}]
+    response = client.post('/batch', json={"requests": items}, headers=token('admin'))
+    assert response.status_code == 400
+
+def test_batch_size_is_limited(client, monkeypatch):
+    from routes import batch_routes
+    monkeypatch.setattr(batch_routes, 'BATCH_MAX_ITEMS', 3)
+    item = {"method": "GET", "path": "/courses/10"}
+
+    assert client.post('/batch', json={"requests": [item] * 3}, headers=token('admin')).status_code == 200
+    assert client.post('/batch', json={"requests": [item] * 4}, headers=token('admin')).status_code == 400
+    assert client.post('/batch', json={"requests": []}, headers=token('admin')).status_code == 400
@@ -0,0 +1,102 @@
+from conftest import token
+from utils import circuit_breaker, fault_injection, metrics
+from utils.circuit_breaker import CircuitBreaker, CircuitOpen
+from utils.deadline import BackendUnavailable, call_backend
+import threading
+import time
+import pytest
+
+@pytest.fixture
+def breaker(monkeypatch):
+    """A storage breaker that opens after 2 failures and probes after 0.1s"""
+    breaker = CircuitBreaker('storage', failure_threshold=2, reset_timeout=0.1)
+    monkeypatch.setattr(circuit_breaker, '_breakers', {'storage': breaker})
+    yield breaker
+    fault_injection.clear_faults()
+
+def counting(calls):
+    def fn(timeout=None, retry=None):
+        calls.append(timeout)
+        return 'ok'
+    return fn
+
+def test_breaker_opens_probes_and_closes(breaker):
+    calls = []
+    fault_injection.set_fault('storage', error_rate=1)
+    with pytest.raises(BackendUnavailable):
+        call_backend('storage', counting(calls))
+    assert breaker.state == 'open'
+
+    # Open: calls fail fast without reaching the dependency
+    fault_injection.clear_faults()
+    with pytest.raises(CircuitOpen):
+        call_backend('storage', counting(calls))
+    assert calls == []
+
+    # After the reset timeout one probe goes through and its success closes the breaker
+    time.sleep(0.1)
+    assert call_backend('storage', counting(calls)) == 'ok'
+    assert breaker.state == 'closed'
+    assert len(calls) == 1
+
+def test_a_failed_probe_opens_the_breaker_again(breaker):
+    fault_injection.set_fault('storage', error_rate=1)
+    with pytest.raises(BackendUnavailable):
+        call_backend('storage', counting([]))
+    time.sleep(0.1)
+
+    with pytest.raises(BackendUnavailable):
+        call_backend('storage', counting([]), max_attempts=1)
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpen):
+        call_backend('storage', counting([]))
+
+def test_only_one_probe_is_let_through(breaker):
+    fault_injection.set_fault('storage', error_rate=1)
+    with pytest.raises(BackendUnavailable):
+        call_backend('storage', counting([]))
+    fault_injection.clear_faults()
+    time.sleep(0.1)
+
+    probing, release = threading.Event(), threading.Event()
+    def slow_probe(timeout=None, retry=None):
+        probing.set()
+        release.wait(5)
+        return 'ok'
+    probe = threading.Thread(target=call_backend, args=('storage', slow_probe))
+    probe.start()
+    probing.wait(5)
+
+    assert breaker.state == 'half_open'
+    calls = []
+    with pytest.raises(CircuitOpen):
+        call_backend('storage', counting(calls))
+    assert calls == []
+
+    release.set()
+    probe.join(5)
+    assert breaker.state == 'closed'
+    assert call_backend('storage', counting(calls)) == 'ok'
+
+def test_get_user_leaves_out_avatar_url_while_storage_fails(client, storage):
+    storage['avatars/3.png'] = b'png'
+    fault_injection.set_fault('storage', error_rate=1)
+    try:
+        before = metrics.snapshot().get('deadline.storage.transient_errors', 0)
+        started = time.monotonic()
+        response = client.get('/users/3', headers=token('student1'))
+        elapsed = time.monotonic() - started
+        errors = metrics.snapshot().get('deadline.storage.transient_errors', 0) - before
+    finally:
+        fault_injection.clear_faults()
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert 'avatar_url' not in body
+    assert body['courses'] == ['http://localhost/courses/10']
+    # One attempt, no retries holding up the profile
+    assert errors == 1
+    assert elapsed < 0.5
+
+    # Once Storage recovers the avatar is back
+    assert client.get('/users/3', headers=token('student1')).get_json()['avatar_url'].endswith('/users/3/avatar')
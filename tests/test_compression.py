@@ -0,0 +1,68 @@
+from flask import Response, jsonify, send_file
+import gzip
+import io
+import json
+import pytest
+
+BIG = {"courses": [{"subject": "CS", "number": i, "title": "Cloud Application Development"} for i in range(100)]}
+
+@pytest.fixture
+def client(make_app, monkeypatch):
+    monkeypatch.setenv('COMPRESSION_MIN_SIZE', '1024')
+    app = make_app()
+    app.add_url_rule('/big', 'big', lambda: jsonify(BIG))
+    app.add_url_rule('/small', 'small', lambda: jsonify({"id": 1}))
+    app.add_url_rule('/png', 'png', lambda: Response(b'\0' * 4096, mimetype='image/png'))
+    app.add_url_rule('/file', 'file', lambda: send_file(io.BytesIO(b'{}' * 4096), mimetype='application/json'))
+    app.add_url_rule('/stream', 'stream', lambda: Response((f"line {i}\n" for i in range(1000)), mimetype='text/plain'))
+    return app.test_client()
+
+def test_large_json_is_gzipped(client):
+    response = client.get('/big', headers={"Accept-Encoding": "gzip"})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert int(response.headers['Content-Length']) == len(response.data) < 1024
+    assert response.vary.as_set() == {'accept-encoding'}
+    assert json.loads(gzip.decompress(response.data)) == BIG
+
+def test_responses_under_the_threshold_are_left_alone(client):
+    response = client.get('/small', headers={"Accept-Encoding": "gzip"})
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_json() == {"id": 1}
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+def test_types_off_the_allowlist_are_left_alone(client):
+    response = client.get('/png', headers={"Accept-Encoding": "gzip"})
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == b'\0' * 4096
+
+@pytest.mark.parametrize('accept', [None, 'identity', 'gzip;q=0', 'deflate'])
+def test_clients_that_do_not_accept_gzip_get_identity(client, accept):
+    headers = {"Accept-Encoding": accept} if accept else {}
+    response = client.get('/big', headers=headers)
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_json() == BIG
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+def test_brotli_is_preferred_when_installed(client):
+    brotli = pytest.importorskip('brotli')
+    response = client.get('/big', headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data).startswith(b'{"courses"')
+
+def test_send_file_passthrough_is_left_alone(client):
+    response = client.get('/file', headers={"Accept-Encoding": "gzip"})
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == b'{}' * 4096
+
+def test_streamed_responses_decode(client):
+    response = client.get('/stream', headers={"Accept-Encoding": "gzip"}, buffered=False)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    chunks = list(response.response)
+    assert len(chunks) > 1
+    assert gzip.decompress(b''.join(chunks)).decode() == ''.join(f"line {i}\n" for i in range(1000))
+
+def test_compression_can_be_turned_off(client, monkeypatch):
+    monkeypatch.setenv('COMPRESSION_ENABLED', 'false')
+    response = client.get('/big', headers={"Accept-Encoding": "gzip"})
+    assert 'Content-Encoding' not in response.headers
@@ -0,0 +1,49 @@
+from conftest import token
+
+def test_delete_course_removes_its_enrollments_first(client, datastore):
+    for i in range(3):
+        datastore.add('enrollments', 30 + i, student_id=4, course_id=10)
+    datastore.add('enrollments', 40, student_id=4, course_id=11)
+
+    response = client.delete('/courses/10', headers=token('admin'))
+
+    assert response.status_code == 204
+    remaining = [entity for (_, kind, _), entity in datastore.store.items() if kind == 'enrollments']
+    assert [entity['course_id'] for entity in remaining] == [11]
+    assert (None, 'courses', 10) not in datastore.store
+    deletes = [call for call in datastore.calls if call[0] in ('delete', 'delete_multi')]
+    assert deletes == [('delete_multi', 4), ('delete', 'courses')]
+    assert client.get('/users/3', headers=token('student1')).get_json()['courses'] == []
+
+def test_stale_course_copies_never_decide_permission(client, monkeypatch):
+    from conftest import StubDatastore
+    from google.api_core.exceptions import ServiceUnavailable
+    assert client.get('/courses/10').status_code == 200
+
+    get = StubDatastore.get
+    def failing_get(self, key, **kwargs):
+        if key.kind == 'courses':
+            raise ServiceUnavailable("datastore down")
+        return get(self, key, **kwargs)
+    monkeypatch.setattr(StubDatastore, 'get', failing_get)
+
+    # The public read may fall back to the last good copy...
+    assert client.get('/courses/10').status_code == 200
+    # ...but the instructor check must not
+    assert client.get('/courses/10/students', headers=token('instructor')).status_code == 503
+    response = client.patch('/courses/10/students', json={"add": [4], "remove": []}, headers=token('instructor'))
+    assert response.status_code == 503
+
+def test_public_course_reads_serve_the_last_good_copy_while_datastore_fails(client):
+    from utils import fault_injection
+    first = client.get('/courses/10').get_json()
+    listed = client.get('/courses?limit=2').get_json()
+
+    fault_injection.set_fault('datastore', error_rate=1)
+    try:
+        assert client.get('/courses/10').get_json() == first
+        assert client.get('/courses?limit=2').get_json() == listed
+        # Nothing to fall back on for a course never read
+        assert client.get('/courses/11').status_code == 503
+    finally:
+        fault_injection.clear_faults()
@@ -0,0 +1,112 @@
+from conftest import StubDatastore
+from google.api_core.exceptions import ServiceUnavailable
+from google.cloud.datastore import Entity
+from utils import circuit_breaker, metrics
+from utils.datastore_client import DeadlineClient
+from utils.deadline import BackendUnavailable, DeadlineExceeded, call_backend, deadline_var
+import time
+import pytest
+
+@pytest.fixture(autouse=True)
+def breakers(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, '_breakers', {})
+
+@pytest.fixture
+def budget():
+    """Run the test under a request deadline of the given seconds"""
+    tokens = []
+    def set_budget(seconds):
+        tokens.append(deadline_var.set(time.monotonic() + seconds))
+    yield set_budget
+    for token in reversed(tokens):
+        deadline_var.reset(token)
+
+def counter(name):
+    return metrics.snapshot().get(name, 0)
+
+def flaky(failures, calls):
+    """A call that fails with a transient error the first failures times"""
+    def fn(timeout=None, retry=None):
+        calls.append(timeout)
+        if len(calls) <= failures:
+            raise ServiceUnavailable("unavailable")
+        return 'ok'
+    return fn
+
+def test_transient_errors_are_retried_within_the_budget(budget):
+    budget(5)
+    calls = []
+    retries, transient = counter('deadline.test.retries'), counter('deadline.test.transient_errors')
+
+    assert call_backend('test', flaky(2, calls)) == 'ok'
+
+    assert len(calls) == 3
+    # Each attempt gets what is left of the budget as its timeout
+    assert 4 < calls[2] <= calls[1] <= calls[0] <= 5
+    assert counter('deadline.test.retries') - retries == 2
+    assert counter('deadline.test.transient_errors') - transient == 2
+
+def test_retries_stop_after_max_attempts(budget):
+    budget(5)
+    calls = []
+    with pytest.raises(BackendUnavailable) as error:
+        call_backend('test', flaky(10, calls))
+    assert not isinstance(error.value, DeadlineExceeded)
+    assert len(calls) == 3
+
+def test_deadline_exceeded_once_the_budget_runs_out(budget):
+    budget(0.3)
+    calls = []
+    def slow_failure(timeout=None, retry=None):
+        calls.append(timeout)
+        time.sleep(min(timeout, 0.2))
+        raise ServiceUnavailable("unavailable")
+    exhausted = counter('deadline.test.exhausted')
+    started = time.monotonic()
+
+    with pytest.raises(DeadlineExceeded):
+        call_backend('test', slow_failure)
+
+    assert time.monotonic() - started < 0.5
+    assert all(timeout <= 0.3 for timeout in calls)
+    assert counter('deadline.test.exhausted') - exhausted == 1
+
+def test_no_attempt_starts_without_budget(budget):
+    budget(0)
+    calls = []
+    with pytest.raises(DeadlineExceeded):
+        call_backend('test', flaky(0, calls))
+    assert calls == []
+
+def test_put_to_an_incomplete_key_is_not_retried(budget):
+    budget(5)
+    calls = []
+    class FailingDatastore(StubDatastore):
+        def put(self, entity, timeout=None, retry=None):
+            calls.append(entity.key.is_partial)
+            raise ServiceUnavailable("unavailable")
+    client = DeadlineClient(FailingDatastore({}, []))
+
+    with pytest.raises(BackendUnavailable):
+        client.put(Entity(key=client.key('enrollments')))
+    assert calls == [True]
+
+    # A complete key is safe to write again
+    with pytest.raises(BackendUnavailable):
+        client.put(Entity(key=client.key('enrollments', 1)))
+    assert calls == [True, False, False, False]
+
+def test_login_is_not_retried_and_fails_with_503(client, monkeypatch):
+    import requests
+    calls = []
+    def post(url, timeout=None, **kwargs):
+        calls.append(timeout)
+        raise requests.ConnectionError("auth0 unreachable")
+    monkeypatch.setattr(requests, 'post', post)
+
+    response = client.post('/users/login', json={"username": "a@example.com", "password": "secret"})
+
+    assert len(calls) == 1
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert response.get_json() == {"Error": "Service unavailable"}
@@ -0,0 +1,114 @@
+from concurrent.futures import ThreadPoolExecutor
+from conftest import StubDatastore, token
+from google.cloud.datastore import Entity
+from utils.deadline import DeadlineExceeded, deadline_var
+from utils.group_commit import WriteBatcher, _PendingWrite
+import threading
+import time
+import pytest
+
+class RejectingDatastore(StubDatastore):
+    """Rejects any put of an entity marked invalid"""
+    def put_multi(self, entities, timeout=None, retry=None):
+        if any(entity.get('invalid') for entity in entities):
+            raise ValueError("invalid entity")
+        super().put_multi(entities)
+
+def make_batcher(client):
+    return WriteBatcher('test', lambda: client, window=0)
+
+def enrollment(client, student_id, **props):
+    entity = Entity(key=client.key('enrollments'))
+    entity.update(course_id=10, student_id=student_id, **props)
+    return entity
+
+def test_requests_removing_the_same_enrollment_both_succeed():
+    store, calls = {}, []
+    client = StubDatastore(store, calls)
+    store[(None, 'enrollments', 20)] = Entity(key=client.key('enrollments', 20))
+
+    writes = [_PendingWrite([], [client.key('enrollments', 20)]) for _ in range(2)]
+    make_batcher(client)._commit(writes)
+
+    assert [write.error for write in writes] == [None, None]
+    assert (None, 'enrollments', 20) not in store
+    assert calls == [('delete_multi', 1)]
+
+def test_only_requests_with_invalid_writes_fail():
+    store, calls = {}, []
+    client = RejectingDatastore(store, calls)
+    good = _PendingWrite([enrollment(client, 3)], [])
+    bad = _PendingWrite([enrollment(client, 4, invalid=True)], [])
+    make_batcher(client)._commit([good, bad])
+
+    assert good.error is None and good.done.is_set()
+    assert isinstance(bad.error, ValueError) and bad.done.is_set()
+    assert [entity['student_id'] for entity in store.values()] == [3]
+
+def test_a_request_that_times_out_before_its_commit_withdraws_its_writes():
+    store, calls = {}, []
+    client = StubDatastore(store, calls)
+    batcher = WriteBatcher('test', lambda: client, window=0.2)
+
+    token = deadline_var.set(time.monotonic() + 0.05)
+    try:
+        with pytest.raises(DeadlineExceeded):
+            batcher.submit([enrollment(client, 3)], [])
+    finally:
+        deadline_var.reset(token)
+    time.sleep(0.3)
+
+    assert calls == [] and store == {}
+
+def test_a_request_that_times_out_during_its_commit_waits_for_it():
+    store, calls = {}, []
+    release = threading.Event()
+    class SlowDatastore(StubDatastore):
+        def put_multi(self, entities, timeout=None, retry=None):
+            release.wait(1)
+            super().put_multi(entities)
+    client = SlowDatastore(store, calls)
+    batcher = WriteBatcher('test', lambda: client, window=0)
+    threading.Timer(0.2, release.set).start()
+
+    token = deadline_var.set(time.monotonic() + 0.05)
+    try:
+        batcher.submit([enrollment(client, 3)], [])
+    finally:
+        deadline_var.reset(token)
+
+    # The write went through, so the request must not have reported a failure
+    assert [entity['student_id'] for entity in store.values()] == [3]
+
+def test_concurrent_enrollment_requests_share_one_commit(make_app, datastore, monkeypatch):
+    from utils import group_commit
+    monkeypatch.setenv('ENROLLMENT_GROUP_COMMIT', 'true')
+    monkeypatch.setenv('ENROLLMENT_GROUP_COMMIT_MS', '200')
+    monkeypatch.setattr(group_commit, '_enrollment_batchers', {})
+    students = range(5, 9)
+    for student_id in students:
+        datastore.add('users', student_id, role='student', sub=f"student{student_id}")
+    app = make_app()
+
+    committed = []
+    put_multi = StubDatastore.put_multi
+    def recording_put_multi(self, entities, **kwargs):
+        put_multi(self, entities, **kwargs)
+        committed.append(time.monotonic())
+    monkeypatch.setattr(StubDatastore, 'put_multi', recording_put_multi)
+
+    start = threading.Barrier(len(students))
+    def enroll(student_id):
+        client = app.test_client()
+        start.wait()
+        response = client.patch('/courses/11/students', json={"add": [student_id], "remove": []}, headers=token('admin'))
+        return response.status_code, time.monotonic()
+    with ThreadPoolExecutor(max_workers=len(students)) as pool:
+        results = list(pool.map(enroll, students))
+
+    assert [status for status, _ in results] == [200] * len(students)
+    assert [call for call in datastore.calls if call[0] in ('put', 'put_multi')] == [('put_multi', len(students))]
+    # Every request answered only after the commit carrying its write
+    assert all(returned >= committed[0] for _, returned in results)
+    enrolled = sorted(e['student_id'] for (_, kind, _), e in datastore.store.items() if kind == 'enrollments' and e['course_id'] == 11)
+    assert enrolled == list(students)
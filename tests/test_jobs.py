@@ -0,0 +1,96 @@
+from utils.jobs import DatastoreJobStore, Job, JobQueue
+import threading
+import time
+import pytest
+
+def wait_for(queue, job_id, status):
+    for _ in range(200):
+        job = queue.get(job_id)
+        if job and job.status == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} never reached {status}")
+
+@pytest.fixture
+def workers(datastore):
+    """Two job queues standing in for two gunicorn workers sharing Datastore"""
+    return JobQueue(workers=1, store=DatastoreJobStore()), JobQueue(workers=1, store=DatastoreJobStore())
+
+def test_job_status_is_visible_from_another_worker(workers):
+    first, second = workers
+    job = first.submit('double', lambda x: {"value": x * 2}, 21)
+
+    done = wait_for(second, job.id, 'succeeded')
+    assert done.result == {"value": 42}
+    assert done.attempts == 1
+
+def test_idempotency_key_is_shared_between_workers(workers):
+    first, second = workers
+    runs = []
+    release = threading.Event()
+    def work():
+        runs.append(1)
+        release.wait(1)
+
+    job = first.submit('work', work, idempotency_key='abc')
+    repeat = second.submit('work', work, idempotency_key='abc')
+    release.set()
+
+    assert repeat.id == job.id
+    wait_for(second, job.id, 'succeeded')
+    assert runs == [1]
+
+def test_job_route_reads_the_shared_store(client, monkeypatch):
+    from utils import jobs
+    queue = JobQueue(workers=1, store=DatastoreJobStore())
+    monkeypatch.setattr(jobs, '_job_queue', JobQueue(workers=1, store=DatastoreJobStore()))
+    job = queue.submit('noop', lambda: "done")
+    wait_for(queue, job.id, 'succeeded')
+
+    response = client.get(f'/jobs/{job.id}')
+    assert response.status_code == 200
+    assert response.get_json()['result'] == "done"
+
+def test_a_failed_submit_leaves_the_idempotency_key_free(workers, monkeypatch):
+    from conftest import StubDatastore
+    first, second = workers
+    put = StubDatastore.put
+    def failing_put(self, entity, **kwargs):
+        if entity.key.kind == 'jobs':
+            raise RuntimeError("datastore down")
+        return put(self, entity, **kwargs)
+    monkeypatch.setattr(StubDatastore, 'put', failing_put)
+    with pytest.raises(RuntimeError):
+        first.submit('work', lambda: "done", idempotency_key='abc')
+    monkeypatch.setattr(StubDatastore, 'put', put)
+
+    job = second.submit('work', lambda: "done", idempotency_key='abc')
+    assert wait_for(second, job.id, 'succeeded').result == "done"
+
+def test_a_job_lost_with_its_process_fails_and_frees_its_key(workers):
+    first, second = workers
+    # What a worker recycled mid-job leaves behind: running, with a lease nobody renews
+    lost = Job('work', None, (), {}, 'abc')
+    lost.status = 'running'
+    lost.lease_expires_at = time.time() - 1
+    DatastoreJobStore().add(lost)
+
+    reported = second.get(lost.id)
+    assert reported.status == 'failed'
+    assert reported.error
+
+    job = second.submit('work', lambda: "again", idempotency_key='abc')
+    assert job.id != lost.id
+    assert wait_for(first, job.id, 'succeeded').result == "again"
+
+def test_a_running_job_keeps_its_lease(datastore):
+    first = JobQueue(workers=1, store=DatastoreJobStore(), lease=0.1)
+    second = JobQueue(workers=1, store=DatastoreJobStore())
+    release = threading.Event()
+    job = first.submit('slow', lambda: release.wait(1))
+
+    wait_for(second, job.id, 'running')
+    time.sleep(0.3)
+    assert second.get(job.id).status == 'running'
+    release.set()
+    assert wait_for(second, job.id, 'succeeded').lease_expires_at is None
@@ -0,0 +1,35 @@
+from utils import log
+import logging
+import queue
+import time
+
+def test_stopping_the_writer_flushes_queued_records(capsys):
+    log.configure_logging()
+    # Restart the writer so it writes to the captured stdout
+    log.stop_listener()
+    log.start_listener()
+    logger = logging.getLogger('tests.log')
+    for i in range(500):
+        logger.critical("record %d", i)
+    log.stop_listener()
+    log.start_listener()
+
+    lines = [line for line in capsys.readouterr().out.splitlines() if '"tests.log"' in line]
+    assert len(lines) == 500
+    assert lines[-1].endswith('"message": "record 499", "request_id": null}')
+
+def test_stopping_the_writer_waits_for_room_on_a_full_queue():
+    records = queue.Queue(maxsize=2)
+    written = []
+    class Collect(logging.Handler):
+        def emit(self, record):
+            time.sleep(0.01)
+            written.append(record.getMessage())
+    for i in range(2):
+        records.put_nowait(logging.makeLogRecord({"msg": f"record {i}"}))
+
+    listener = log.FlushingQueueListener(records, Collect())
+    listener.start()
+    listener.stop()
+
+    assert written == ["record 0", "record 1"]
@@ -0,0 +1,30 @@
+from conftest import token
+import marshal
+import pytest
+
+@pytest.fixture
+def make_profiling_app(make_app, monkeypatch):
+    monkeypatch.setenv('PROFILING_ENABLED', 'true')
+    return make_app
+
+def test_request_profile_can_be_downloaded_from_another_worker(make_profiling_app, storage):
+    profiled = make_profiling_app().test_client()
+    response = profiled.get('/courses', headers=dict(token('admin'), **{"X-Profile": "1"}))
+    profile_id = response.headers['X-Profile-Id']
+    assert f"profiles/default/{profile_id}.pstats" in storage
+
+    other_worker = make_profiling_app().test_client()
+    download = other_worker.get(f'/admin/profiles/{profile_id}', headers=token('admin'))
+    assert download.status_code == 200
+    assert isinstance(marshal.loads(download.data), dict)
+
+def test_unknown_profile_is_not_found(make_profiling_app):
+    client = make_profiling_app().test_client()
+    assert client.get('/admin/profiles/../avatars/3', headers=token('admin')).status_code == 404
+    assert client.get(f"/admin/profiles/{'0' * 32}", headers=token('admin')).status_code == 404
+
+def test_sample_returns_collapsed_stacks(make_profiling_app):
+    client = make_profiling_app().test_client()
+    response = client.post('/admin/profiler/sample?seconds=0.05', headers=token('admin'))
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
@@ -0,0 +1,50 @@
+from utils.rate_limit import DEFAULT_LIMITS, get_limits, validate_limits
+import pytest
+import sys
+import types
+
+def test_defaults_apply_without_an_override(monkeypatch):
+    monkeypatch.delenv('RATE_LIMIT_AVATAR', raising=False)
+    validate_limits()
+    assert get_limits('avatar') == DEFAULT_LIMITS['avatar']
+
+def test_override(monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT_AVATAR', '0.5,3,2')
+    validate_limits()
+    assert get_limits('avatar') == (0.5, 3, 2)
+
+@pytest.mark.parametrize('limits', ['5,20', '5,20,8,1', 'fast,20,8', '5,20,2.5', '0,20,8', '-1,20,8', 'nan,20,8', 'inf,20,8', '5,0.5,8', '5,20,0'])
+def test_invalid_limits_fail_validation(monkeypatch, limits):
+    monkeypatch.setenv('RATE_LIMIT_BATCH', limits)
+    with pytest.raises(ValueError, match='RATE_LIMIT_BATCH'):
+        validate_limits()
+
+def test_invalid_limits_stop_the_app_from_starting(make_app, monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT_ENROLLMENT', '0,20,8')
+    with pytest.raises(ValueError, match='RATE_LIMIT_ENROLLMENT'):
+        make_app()
+
+@pytest.fixture
+def no_backend(monkeypatch):
+    from utils import rate_limit
+    monkeypatch.setattr(rate_limit, '_backend', None)
+    monkeypatch.setenv('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+
+def test_redis_without_the_package_fails_validation(no_backend, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'redis', None)
+    with pytest.raises(ImportError, match='RATE_LIMIT_REDIS_URL'):
+        validate_limits()
+
+def test_an_invalid_redis_url_fails_validation(no_backend, monkeypatch):
+    redis = types.ModuleType('redis')
+    def from_url(url):
+        raise ValueError("Redis URL must specify one of the following schemes")
+    redis.Redis = types.SimpleNamespace(from_url=from_url)
+    monkeypatch.setitem(sys.modules, 'redis', redis)
+    with pytest.raises(ValueError, match='RATE_LIMIT_REDIS_URL'):
+        validate_limits()
+
+def test_redis_without_the_package_stops_the_app_from_starting(no_backend, make_app, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'redis', None)
+    with pytest.raises(ImportError):
+        make_app()
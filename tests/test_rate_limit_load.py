@@ -0,0 +1,87 @@
+"""
+Load test for the rate limiter: threads hammer app.test_client() over the stub
+Datastore and check that rejections are fast and accepted requests stay bounded.
+Run with `python -m pytest -s tests/test_rate_limit_load.py` to see the summary.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import math
+import time
+
+import pytest
+
+from conftest import token
+
+ENROLLMENT = {"add": [], "remove": []}
+
+@pytest.fixture
+def limited_app(make_app, monkeypatch):
+    """Build an app with rate limiting on and fresh buckets and in-flight slots"""
+    from utils import fault_injection, rate_limit
+    monkeypatch.setattr(rate_limit, '_backend', rate_limit.MemoryBackend())
+    monkeypatch.setattr(rate_limit, '_slots', {})
+    def make(limits):
+        monkeypatch.setenv('RATE_LIMIT_ENROLLMENT', limits)
+        app = make_app()
+        monkeypatch.setenv('RATE_LIMIT_ENABLED', 'true')
+        return app
+    yield make
+    fault_injection.clear_faults()
+
+def run_load(app, subs, requests_per_caller):
+    """Send PATCH /courses/10/students from one thread per sub; return (status, seconds, Retry-After) per request"""
+    def caller(sub):
+        client = app.test_client()
+        results = []
+        for _ in range(requests_per_caller):
+            start = time.perf_counter()
+            response = client.patch('/courses/10/students', json=ENROLLMENT, headers=token(sub))
+            results.append((response.status_code, time.perf_counter() - start, response.headers.get('Retry-After')))
+        return results
+
+    with ThreadPoolExecutor(max_workers=len(subs)) as pool:
+        return [result for results in pool.map(caller, subs) for result in results]
+
+def p99(latencies):
+    ordered = sorted(latencies)
+    return ordered[max(0, math.ceil(len(ordered) * 0.99) - 1)]
+
+def summarize(name, results):
+    """Print request counts and latencies by status"""
+    print(f"\n{name}: {len(results)} requests")
+    for status in sorted({status for status, _, _ in results}):
+        latencies = [seconds for code, seconds, _ in results if code == status]
+        print(f"  {status}: {len(latencies):4d}  p50 {sorted(latencies)[len(latencies) // 2] * 1000:7.1f}ms"
+              f"  p99 {p99(latencies) * 1000:7.1f}ms  max {max(latencies) * 1000:7.1f}ms")
+
+def test_one_caller_over_its_rate_gets_fast_429s(limited_app):
+    app = limited_app("5,20,100")
+
+    results = run_load(app, ['admin'] * 8, 20)
+    summarize("one caller, 8 threads", results)
+
+    accepted = [seconds for status, seconds, _ in results if status == 200]
+    rejected = [(seconds, retry_after) for status, seconds, retry_after in results if status == 429]
+    # The burst of 20 plus whatever refills at 5/s during the run
+    assert 20 <= len(accepted) < 40
+    assert len(accepted) + len(rejected) == len(results)
+    assert all(retry_after and int(retry_after) >= 1 for _, retry_after in rejected)
+    assert p99([seconds for seconds, _ in rejected]) < 0.05
+    assert max(accepted) < 1
+
+def test_slow_backend_fills_in_flight_cap_and_sheds_503s(limited_app):
+    from utils import fault_injection
+    app = limited_app("1000,1000,4")
+    fault_injection.set_fault('datastore', latency=0.1)
+
+    results = run_load(app, [f"caller-{i}" for i in range(16)], 5)
+    summarize("16 callers, datastore +100ms", results)
+
+    # Unknown callers are refused by the handler once it has looked them up
+    accepted = [seconds for status, seconds, _ in results if status == 403]
+    shed = [(seconds, retry_after) for status, seconds, retry_after in results if status == 503]
+    assert len(accepted) + len(shed) == len(results)
+    assert len(shed) > len(results) // 2
+    assert all(retry_after == '1' for _, retry_after in shed)
+    assert p99([seconds for seconds, _ in shed]) < 0.05
+    # Shedding keeps the admitted requests from queueing behind each other
+    assert max(accepted) < 1
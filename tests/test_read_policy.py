@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+from utils.read_policy import MAX_STALENESS_SECONDS, read_options, validate_policies
+import pytest
+
+def test_strong_is_the_default(monkeypatch):
+    monkeypatch.delenv('READ_POLICY_COURSES_LIST', raising=False)
+    assert read_options('courses_list') == {}
+
+def test_eventual(monkeypatch):
+    monkeypatch.setenv('READ_POLICY_COURSES_LIST', 'Eventual')
+    assert read_options('courses_list') == {"eventual": True}
+
+@pytest.mark.parametrize('seconds, expected', [
+    ('15', 15),
+    ('0.5', 0.5),
+    ('3600', MAX_STALENESS_SECONDS),
+    ('7200', MAX_STALENESS_SECONDS),
+])
+def test_stale_reads_a_snapshot_that_many_seconds_old(monkeypatch, seconds, expected):
+    monkeypatch.setenv('READ_POLICY_COURSE_GET', f"stale:{seconds}")
+    before = datetime.now(timezone.utc)
+    read_time = read_options('course_get')['read_time']
+    after = datetime.now(timezone.utc)
+    assert before.timestamp() - expected - 0.01 <= read_time.timestamp() <= after.timestamp() - expected
+
+def test_an_hour_of_staleness_leaves_a_margin_for_the_rpc(monkeypatch):
+    # Datastore rejects a read_time more than an hour old when the RPC arrives
+    monkeypatch.setenv('READ_POLICY_COURSE_GET', 'stale:3600')
+    read_time = read_options('course_get')['read_time']
+    assert datetime.now(timezone.utc).timestamp() - read_time.timestamp() < 3600 - 30
+
+@pytest.mark.parametrize('policy', ['stale:abc', 'stale:', 'stale:-5', 'stale:0', 'stale:nan', 'stale:inf', 'eventually', ''])
+def test_invalid_policies_fail_validation(monkeypatch, policy):
+    monkeypatch.setenv('READ_POLICY_USERS_LIST', policy)
+    with pytest.raises(ValueError, match='READ_POLICY_USERS_LIST'):
+        validate_policies()
+
+def test_invalid_policy_stops_app_creation(make_app, monkeypatch):
+    monkeypatch.setenv('READ_POLICY_COURSES_LIST', 'stale:abc')
+    with pytest.raises(ValueError):
+        make_app()
@@ -0,0 +1,52 @@
+from utils import metrics
+from utils.deadline import DeadlineExceeded
+from utils.singleflight import SingleFlight
+import threading
+
+def follow_failed_leader(monkeypatch, leader_error):
+    """Fail a leader with leader_error once a follower has joined its call; return what the follower got"""
+    joined, calls = threading.Event(), []
+    increment = metrics.increment
+    def record(name, *args, **kwargs):
+        if name.endswith('.coalesced'):
+            joined.set()
+        return increment(name, *args, **kwargs)
+    monkeypatch.setattr(metrics, 'increment', record)
+
+    flight = SingleFlight('test')
+    def leader_fn():
+        calls.append('leader')
+        joined.wait(5)
+        raise leader_error
+    def follower_fn():
+        calls.append('follower')
+        return 'fresh'
+
+    leader = threading.Thread(target=lambda: calls.append(_outcome(flight, leader_fn)))
+    leader.start()
+    while 'leader' not in calls:
+        pass
+    outcome = _outcome(flight, follower_fn)
+    leader.join(5)
+    return outcome, calls
+
+def _outcome(flight, fn):
+    try:
+        return flight.do('key', fn)
+    except Exception as e:
+        return e
+
+def test_follower_retries_when_the_leader_ran_out_of_its_own_budget(monkeypatch):
+    leader_error = DeadlineExceeded("leader out of time")
+    outcome, calls = follow_failed_leader(monkeypatch, leader_error)
+
+    assert outcome == 'fresh'
+    # The leader keeps its own error, the follower made a call of its own
+    assert sorted(map(str, calls)) == sorted(map(str, ['leader', 'follower', leader_error]))
+
+def test_follower_shares_other_leader_errors(monkeypatch):
+    leader_error = ValueError("bad read")
+    outcome, calls = follow_failed_leader(monkeypatch, leader_error)
+
+    assert outcome is leader_error
+    assert calls == ['leader', leader_error]
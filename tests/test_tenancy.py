@@ -0,0 +1,23 @@
+import json
+import pytest
+
+@pytest.fixture
+def tenant_client(make_app, monkeypatch, datastore):
+    from utils import tenancy
+    monkeypatch.setenv('TENANTS', json.dumps({"osu": {"hosts": ["api.osu.edu"]}}))
+    monkeypatch.setattr(tenancy, '_tenants', None)
+    datastore.store[('osu', 'users', 7)] = datastore.store.pop((None, 'users', 4))
+    return make_app().test_client()
+
+def test_debug_routes_use_the_tenant_namespace(tenant_client, datastore):
+    users = tenant_client.get('/debug-users', base_url='http://api.osu.edu').get_json()
+    assert users['total_users'] == 1
+
+    assert tenant_client.get('/test-datastore', base_url='http://api.osu.edu').status_code == 200
+    assert ('osu', 'test', 'test1') in datastore.store
+    assert (None, 'test', 'test1') not in datastore.store
+
+def test_test_avatar_goes_under_the_tenant_prefix(tenant_client, storage):
+    response = tenant_client.post('/create-test-avatar', json={"user_id": 7}, base_url='http://api.osu.edu')
+    assert response.get_json()['blob_name'] == 'osu/avatars/7.png'
+    assert 'osu/avatars/7.png' in storage
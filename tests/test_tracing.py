@@ -0,0 +1,117 @@
+from conftest import token
+from utils import tracing
+import json
+import time
+import pytest
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+
+@pytest.fixture
+def exporter():
+    exporter = tracing.InMemoryExporter()
+    tracing.set_exporter(exporter)
+    yield exporter
+    tracing.set_exporter(None)
+
+@pytest.fixture
+def traced_client(make_app, exporter, monkeypatch):
+    monkeypatch.setenv('TRACING_SAMPLE_RATE', '1')
+    return make_app().test_client()
+
+def by_name(spans):
+    return {span['name']: span for span in spans}
+
+def test_spans_for_auth_datastore_and_storage(traced_client, exporter, storage):
+    storage['avatars/3.png'] = b'png'
+    assert traced_client.get('/users/3', headers=token('student1')).status_code == 200
+
+    [spans] = exporter.traces
+    queries = [span['attributes']['kind'] for span in spans if span['name'] == 'datastore.query']
+    assert queries == ['users', 'enrollments']
+    spans = by_name(spans)
+    root = spans['GET /users/<int:user_id>']
+    assert root['parent_id'] is None
+    assert root['attributes'] == {
+        "http.method": "GET", "http.path": "/users/3", "tenant": "default", "http.status_code": 200
+    }
+    assert spans['requires_auth']['attributes'] == {"authenticated": True}
+    assert spans['datastore.get']['attributes'] == {"kind": "users", "attempts": 1}
+    assert spans['storage.exists']['attributes'] == {"blob": "avatars/3.png", "attempts": 1}
+    assert all(span['parent_id'] == root['span_id'] for span in spans.values() if span is not root)
+    assert all(span['trace_id'] == root['trace_id'] and span['status'] == 'ok' for span in spans.values())
+
+def test_unauthenticated_requests_record_a_failed_auth_span(traced_client, exporter):
+    assert traced_client.get('/users/3').status_code == 401
+    spans = by_name(exporter.traces[0])
+    assert spans['requires_auth']['attributes'] == {"authenticated": False}
+    assert spans['GET /users/<int:user_id>']['attributes']['http.status_code'] == 401
+
+def test_failed_backend_calls_are_error_spans(traced_client, exporter):
+    from utils import fault_injection
+    fault_injection.set_fault('datastore', error_rate=1)
+    try:
+        assert traced_client.get('/courses/10').status_code == 503
+    finally:
+        fault_injection.clear_faults()
+    spans = by_name(exporter.traces[0])
+    get = spans['datastore.get']
+    assert get['status'] == 'error'
+    assert get['attributes']['attempts'] == 3
+    assert 'BackendUnavailable' in get['attributes']['error']
+    assert spans['GET /courses/<int:course_id>']['status'] == 'error'
+
+@pytest.mark.parametrize('traceparent, expected', [
+    (f"00-{TRACE_ID}-00f067aa0ba902b7-01", (TRACE_ID, True)),
+    (f"00-{TRACE_ID}-00f067aa0ba902b7-03", (TRACE_ID, True)),
+    (f"00-{TRACE_ID}-00f067aa0ba902b7-00", (TRACE_ID, False)),
+    (f"00-{TRACE_ID}-00f067aa0ba902b7-02", (TRACE_ID, False)),
+    (f"00-{TRACE_ID}-00f067aa0ba902b7-0x", (None, False)),
+    (f"00-{TRACE_ID}-00f067aa0ba902b7-1", (None, False)),
+    (f"00-{TRACE_ID.upper()}-00f067aa0ba902b7-01", (None, False)),
+    (f"00-{'0' * 32}-00f067aa0ba902b7-01", (None, False)),
+    (f"00-{TRACE_ID}-{'0' * 16}-01", (None, False)),
+    (f"00-{TRACE_ID[:-1]}z-00f067aa0ba902b7-01", (None, False)),
+    ("", (None, False)),
+    (None, (None, False)),
+])
+def test_traceparent_parsing(traceparent, expected):
+    assert tracing._sampled_upstream(traceparent) == expected
+
+@pytest.mark.parametrize('flags, sampled', [('01', True), ('03', True), ('00', False)])
+def test_upstream_sampling_decision_is_followed(make_app, exporter, monkeypatch, flags, sampled):
+    monkeypatch.setenv('TRACING_SAMPLE_RATE', '0')
+    client = make_app().test_client()
+    client.get('/courses/10', headers={"traceparent": f"00-{TRACE_ID}-00f067aa0ba902b7-{flags}"})
+    if sampled:
+        assert {span['trace_id'] for span in exporter.traces[0]} == {TRACE_ID}
+    else:
+        assert exporter.traces == []
+
+@pytest.mark.parametrize('rate, traced', [('0', 0), ('1', 5)])
+def test_sample_rate(make_app, exporter, monkeypatch, rate, traced):
+    monkeypatch.setenv('TRACING_SAMPLE_RATE', rate)
+    client = make_app().test_client()
+    for _ in range(5):
+        client.get('/courses/10')
+    assert len(exporter.traces) == traced
+    assert len({spans[0]['trace_id'] for spans in exporter.traces}) == traced
+
+def test_file_exporter_writes_json_lines(make_app, monkeypatch, tmp_path):
+    path = tmp_path / 'spans.jsonl'
+    tracing.set_exporter(tracing.FileExporter(str(path)))
+    monkeypatch.setenv('TRACING_SAMPLE_RATE', '1')
+    try:
+        make_app().test_client().get('/courses/10')
+        for _ in range(100):
+            if path.exists() and len(path.read_text().splitlines()) >= 2:
+                break
+            time.sleep(0.01)
+    finally:
+        tracing.set_exporter(None)
+
+    spans = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [span['name'] for span in spans] == ['datastore.get', 'GET /courses/<int:course_id>']
+    assert {span['trace_id'] for span in spans} == {spans[1]['trace_id']}
+    assert set(spans[1]) == {"trace_id", "span_id", "parent_id", "name", "start_time", "duration_ms", "status", "attributes"}
+    assert spans[0]['parent_id'] == spans[1]['span_id']
+    assert spans[0]['duration_ms'] >= 0
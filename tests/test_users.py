@@ -0,0 +1,114 @@
+from conftest import StubStorage, token
+from urllib.parse import parse_qs, urlsplit
+import pytest
+
+@pytest.fixture
+def signed_client(make_app, monkeypatch, storage):
+    monkeypatch.setenv('AVATAR_URL_SIGNED', 'true')
+    storage['avatars/3.png'] = b'png'
+    return make_app().test_client()
+
+def test_owner_gets_a_signed_avatar_url(signed_client):
+    body = signed_client.get('/users/3', headers=token('student1')).get_json()
+    assert body['avatar_url'].startswith('https://storage.googleapis.com/tume-tarpaulin-avatars/avatars/3.png?')
+
+def test_admin_does_not_get_a_signed_avatar_url(signed_client):
+    body = signed_client.get('/users/3', headers=token('admin')).get_json()
+    assert body['avatar_url'].endswith('/users/3/avatar')
+
+def test_deleted_avatar_is_not_served_from_a_cached_signed_url(make_app, monkeypatch, storage):
+    monkeypatch.setenv('AVATAR_URL_SIGNED', 'true')
+    monkeypatch.setenv('AVATAR_DELIVERY', 'redirect')
+    storage['avatars/3.png'] = b'png'
+    client = make_app().test_client()
+    assert client.get('/users/3/avatar', headers=token('student1')).status_code == 302
+
+    # Deleted through another worker, whose signed URL cache this one cannot see
+    del storage['avatars/3.png']
+
+    assert 'avatar_url' not in client.get('/users/3', headers=token('student1')).get_json()
+    assert client.get('/users/3/avatar', headers=token('student1')).status_code == 404
+
+@pytest.fixture
+def service_account(monkeypatch):
+    """Service account credentials with a freshly generated RSA key, recording what they sign"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from google.oauth2 import service_account
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    credentials = service_account.Credentials.from_service_account_info({
+        "type": "service_account",
+        "client_email": "avatars@test-project.iam.gserviceaccount.com",
+        "private_key": pem,
+        "private_key_id": "test",
+        "token_uri": "https://oauth2.googleapis.com/token",
+    })
+    signed = []
+    sign_bytes = credentials.sign_bytes
+    monkeypatch.setattr(credentials, 'sign_bytes', lambda message: signed.append(message) or sign_bytes(message))
+    return credentials, key.public_key(), signed
+
+def test_signed_url_is_v4_signed_with_the_service_account_key(make_app, monkeypatch, storage, service_account):
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+    from google.cloud import storage as gcs
+    from utils.storage import reset_storage_client
+    credentials, public_key, signed = service_account
+    monkeypatch.setattr(gcs, 'Client', lambda **kwargs: StubStorage(storage, credentials))
+    reset_storage_client()
+    monkeypatch.setenv('AVATAR_URL_SIGNED', 'true')
+    storage['avatars/3.png'] = b'png'
+
+    url = make_app().test_client().get('/users/3', headers=token('student1')).get_json()['avatar_url']
+
+    parts = urlsplit(url)
+    params = {name: values[0] for name, values in parse_qs(parts.query).items()}
+    assert parts.path == '/tume-tarpaulin-avatars/avatars/3.png'
+    assert params['X-Goog-Algorithm'] == 'GOOG4-RSA-SHA256'
+    assert params['X-Goog-Expires'] == '900'
+    assert params['X-Goog-Credential'].startswith('avatars@test-project.iam.gserviceaccount.com/')
+    # The signature is the service account key's RSA signature of the V4 string to sign
+    assert len(signed) == 1
+    assert signed[0].decode().startswith('GOOG4-RSA-SHA256\n')
+    public_key.verify(bytes.fromhex(params['X-Goog-Signature']), signed[0], padding.PKCS1v15(), hashes.SHA256())
+
+def course_calls(datastore):
+    """Datastore calls made for the user's courses, leaving out the user lookups"""
+    return [call for call in datastore.calls if call[1] != 'users']
+
+def test_expanded_student_courses_take_one_query_and_one_batched_get(client, datastore):
+    datastore.add('courses', 12, subject='MA', number=341, title='Linear Algebra', term='fall-24', instructor_id=2)
+    datastore.add('enrollments', 21, student_id=3, course_id=12)
+    datastore.add('enrollments', 22, student_id=3, course_id=11)
+    # An enrollment whose course is being deleted is left out
+    datastore.add('enrollments', 23, student_id=3, course_id=99)
+    datastore.calls.clear()
+
+    body = client.get('/users/3?expand=courses', headers=token('student1')).get_json()
+
+    assert course_calls(datastore) == [('query', 'enrollments'), ('get_multi', 4)]
+    assert sorted(course['id'] for course in body['courses']) == [10, 11, 12]
+    for course in body['courses']:
+        assert course == client.get(f"/courses/{course['id']}").get_json()
+
+def test_expanded_instructor_courses_take_one_query(client, datastore):
+    datastore.calls.clear()
+
+    body = client.get('/users/2?expand=courses', headers=token('instructor')).get_json()
+
+    assert course_calls(datastore) == [('query', 'courses')]
+    assert sorted(course['id'] for course in body['courses']) == [10, 11]
+    for course in body['courses']:
+        assert course == client.get(f"/courses/{course['id']}").get_json()
+
+def test_courses_are_urls_without_expand(client, datastore):
+    datastore.add('enrollments', 21, student_id=3, course_id=11)
+    datastore.calls.clear()
+
+    body = client.get('/users/3', headers=token('student1')).get_json()
+
+    assert course_calls(datastore) == [('query', 'enrollments')]
+    assert sorted(body['courses']) == ['http://localhost/courses/10', 'http://localhost/courses/11']
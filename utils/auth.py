@@ -1,9 +1,15 @@
 from functools import wraps
 from flask import request, jsonify
-import jwt
-import requests
+from utils.tracing import start_span
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
+# WSGI environ keys are never set from client headers, so these are safe to trust
+AUTH_PAYLOAD_ENVIRON_KEY = 'tarpaulin.auth_payload'
+CALLER_ENVIRON_KEY = 'tarpaulin.caller'
+
 def get_token_auth_header():
     """Get the access token from the Authorization Header"""
     auth = request.headers.get("Authorization", None)
@@ -24,22 +30,29 @@ def get_token_auth_header():
 def verify_decode_jwt(token):
     """Verify and decode JWT token"""
     try:
+        import jwt
+        
         # Just decode without verification for now (since we're testing locally)
         payload = jwt.decode(token, options={"verify_signature": False})
         return payload
     except Exception as e:
-        print(f"Token verification error: {e}")
+        logger.info("Token verification error: %s", e, extra={"sample_rate": 0.1})
         return None
 
 def requires_auth(f):
     """Decorator to require authentication"""
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = get_token_auth_header()
-        if not token:
-            return jsonify({"Error": "Unauthorized"}), 401
+        # Sub-requests of POST /batch reuse the payload the batch was authenticated with
+        payload = request.environ.get(AUTH_PAYLOAD_ENVIRON_KEY)
+        if payload:
+            return f(payload, *args, **kwargs)
         
-        payload = verify_decode_jwt(token)
+        with start_span('requires_auth') as span:
+            token = get_token_auth_header()
+            payload = verify_decode_jwt(token) if token else None
+            if span is not None:
+                span.set_attribute('authenticated', bool(payload))
         if not payload:
             return jsonify({"Error": "Unauthorized"}), 401
         
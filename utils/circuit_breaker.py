@@ -0,0 +1,80 @@
+"""
+Per-dependency circuit breakers.
+
+After FAILURE_THRESHOLD consecutive transient failures a breaker opens and
+calls fail fast with CircuitOpen. After RESET_TIMEOUT seconds one probe call
+is let through (half-open); its success closes the breaker, its failure
+opens it again.
+"""
+from utils import metrics
+from utils.deadline import BackendUnavailable
+import os
+import threading
+import time
+
+FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5))
+RESET_TIMEOUT = float(os.environ.get('CIRCUIT_RESET_TIMEOUT', 30))
+
+class CircuitOpen(BackendUnavailable):
+    """The dependency's breaker is open, the call was not attempted"""
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one dependency"""
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpen unless a call may go ahead"""
+        with self._lock:
+            if self.state == 'closed':
+                return
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                metrics.increment(f"circuit.{self.name}.probes")
+                return
+        metrics.increment(f"circuit.{self.name}.rejected")
+        raise CircuitOpen(f"{self.name} circuit is open")
+
+    def record_success(self):
+        """The dependency answered"""
+        with self._lock:
+            if self.state != 'closed':
+                metrics.increment(f"circuit.{self.name}.closed")
+            self.state = 'closed'
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        """The dependency failed with a transient error"""
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                if self.state != 'open':
+                    metrics.increment(f"circuit.{self.name}.opened")
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name):
+    """Get the breaker for a dependency"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+def breaker_states():
+    """Get the state of every breaker"""
+    with _breakers_lock:
+        return {name: breaker.state for name, breaker in _breakers.items()}
@@ -0,0 +1,117 @@
+"""
+Negotiated gzip/brotli compression of responses.
+
+Brotli is used when the client accepts it and the optional brotli package is
+installed, gzip otherwise. Only allowlisted content types above a size
+threshold are compressed; streamed responses are compressed chunk by chunk.
+"""
+from utils import metrics
+import os
+import zlib
+
+COMPRESSIBLE_TYPES = {'application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript'}
+
+_brotli = None
+_brotli_checked = False
+
+def get_brotli():
+    """Get the brotli module if it is installed, or None"""
+    global _brotli, _brotli_checked
+    if not _brotli_checked:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = None
+        _brotli_checked = True
+    return _brotli
+
+class GzipEncoder:
+    """Incremental gzip encoder"""
+    name = 'gzip'
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """Emit everything compressed so far without ending the stream"""
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+class BrotliEncoder:
+    """Incremental brotli encoder"""
+    name = 'br'
+
+    def __init__(self, quality):
+        self._compressor = get_brotli().Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        """Emit everything compressed so far without ending the stream"""
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+def choose_encoder(accept_encodings):
+    """Pick an encoder for the request's Accept-Encoding, or None"""
+    if accept_encodings.quality('br') > 0 and get_brotli() is not None:
+        return BrotliEncoder(int(os.environ.get('BROTLI_QUALITY', 4)))
+    if accept_encodings.quality('gzip') > 0:
+        return GzipEncoder(int(os.environ.get('GZIP_LEVEL', 6)))
+    return None
+
+def _compress_stream(chunks, encoder):
+    """Compress an iterable of chunks, flushing after each so clients see progress"""
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = encoder.compress(chunk) + encoder.flush()
+        if data:
+            yield data
+    yield encoder.finish()
+
+def init_compression(app):
+    """Compress eligible responses of the app"""
+    from flask import request
+
+    min_size = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+
+    @app.after_request
+    def compress_response(response):
+        if os.environ.get('COMPRESSION_ENABLED', 'true').lower() == 'false':
+            return response
+
+        response.vary.add('Accept-Encoding')
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+
+        encoder = choose_encoder(request.accept_encodings)
+        if encoder is None:
+            return response
+
+        if response.is_streamed:
+            response.response = _compress_stream(response.response, encoder)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            compressed = encoder.compress(data) + encoder.finish()
+            response.set_data(compressed)
+            metrics.increment("compression.bytes_in", len(data))
+            metrics.increment("compression.bytes_out", len(compressed))
+
+        response.headers['Content-Encoding'] = encoder.name
+        metrics.increment(f"compression.{encoder.name}")
+        return response
@@ -1,9 +1,185 @@
-from google.cloud import datastore
+from utils import metrics
+from utils.deadline import BackendUnavailable, call_backend
+from utils.read_policy import get_policy, read_options
+from utils.singleflight import SingleFlight
+from utils.tenancy import TenantCache, current_tenant
+import logging
 import os
+import threading
 
-def get_datastore_client():
-    """Get Datastore client"""
-    return datastore.Client()
+logger = logging.getLogger(__name__)
+
+# Concurrent identical reads share one Datastore call. Results are shared
+# between callers, so only use these for read-only paths. Keys start with the
+# tenant id so tenants never share a result.
+_course_reads = SingleFlight('courses')
+_user_reads = SingleFlight('users')
+
+# Last good course reads, served by GET /courses and GET /courses/<id> while Datastore is failing
+STALE_TTL = int(os.environ.get('STALE_TTL', 300))
+_stale_courses = TenantCache('stale_courses', max_entries=1000)
+
+def _batch_attributes(keys):
+    """Span attributes for a multi-key call"""
+    return {"kinds": sorted({key.kind for key in keys}), "count": len(keys)}
+
+class DeadlineQuery:
+    """Query wrapper whose fetch runs under the request deadline"""
+    def __init__(self, query):
+        object.__setattr__(self, '_query', query)
+
+    def __getattr__(self, name):
+        return getattr(self._query, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._query, name, value)
+
+    def fetch(self, **kwargs):
+        """Run the query and return all results as a list"""
+        def query(**call_kwargs):
+            return list(self._query.fetch(**call_kwargs))
+        attributes = {"kind": self._query.kind, "limit": kwargs.get('limit'), "offset": kwargs.get('offset')}
+        return call_backend('datastore', query, trace_attributes=attributes, **kwargs)
+
+class DeadlineClient:
+    """Datastore client wrapper that runs every RPC under the request deadline"""
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def query(self, **kwargs):
+        return DeadlineQuery(self._client.query(**kwargs))
+
+    def get(self, key, **kwargs):
+        return call_backend('datastore', self._client.get, key,
+                            trace_attributes={"kind": key.kind}, **kwargs)
+
+    def get_multi(self, keys, **kwargs):
+        return call_backend('datastore', self._client.get_multi, keys,
+                            trace_attributes=_batch_attributes(keys), **kwargs)
+
+    def put(self, entity, **kwargs):
+        # Writes to an incomplete key allocate a new id, so retrying could duplicate
+        return call_backend('datastore', self._client.put, entity,
+                            idempotent=not entity.key.is_partial,
+                            trace_attributes={"kind": entity.key.kind}, **kwargs)
+
+    def put_multi(self, entities, **kwargs):
+        idempotent = not any(entity.key.is_partial for entity in entities)
+        return call_backend('datastore', self._client.put_multi, entities,
+                            idempotent=idempotent,
+                            trace_attributes=_batch_attributes([entity.key for entity in entities]), **kwargs)
+
+    def delete(self, key, **kwargs):
+        return call_backend('datastore', self._client.delete, key,
+                            trace_attributes={"kind": key.kind}, **kwargs)
+
+    def delete_multi(self, keys, **kwargs):
+        return call_backend('datastore', self._client.delete_multi, keys,
+                            trace_attributes=_batch_attributes(keys), **kwargs)
+
+    def run_in_transaction(self, fn, *args):
+        """
+        Run fn(client, *args, timeout=...) in a transaction under the request
+        deadline. Transient failures rerun fn in a new transaction, so it must
+        be safe to run more than once.
+        """
+        def transaction(timeout=None, retry=None):
+            with self._client.transaction():
+                return fn(self._client, *args, timeout=timeout)
+        return call_backend('datastore', transaction)
+
+_clients = {}
+_client_lock = threading.Lock()
+
+def get_datastore_client(tenant=None):
+    """Get the process-wide Datastore client for a tenant (default: the current one), created on first use"""
+    tenant = tenant or current_tenant()
+    client = _clients.get(tenant.id)
+    if client is None:
+        with _client_lock:
+            client = _clients.get(tenant.id)
+            if client is None:
+                from google.cloud import datastore
+                client = DeadlineClient(datastore.Client(namespace=tenant.namespace))
+                _clients[tenant.id] = client
+    return client
+
+def reset_datastore_client():
+    """Drop the cached clients, e.g. in a worker after fork"""
+    _clients.clear()
+
+def new_entity(key):
+    """Create a Datastore entity for a key"""
+    from google.cloud import datastore
+    return datastore.Entity(key=key)
+
+def read_with_stale_fallback(cache, key, read):
+    """Run a read and remember its result; if the backend is failing, serve the last result"""
+    try:
+        result = read()
+    except BackendUnavailable:
+        entry = cache.get(key)
+        if entry is None:
+            raise
+        metrics.increment("stale.served")
+        return entry[0]
+    cache.set(key, (result,), STALE_TTL)
+    return result
+
+def get_course_entity(client, course_id, route):
+    """
+    Get a course entity by id for a read-only route, with the route's read policy.
+    While Datastore is failing this may serve a copy up to STALE_TTL old, so
+    permission checks and mutations must use a plain client.get instead.
+    """
+    policy = get_policy(route)
+    return read_with_stale_fallback(_stale_courses, ('get', course_id), lambda: _course_reads.do(
+        (current_tenant().id, 'get', course_id, policy),
+        lambda: client.get(client.key('courses', course_id), **read_options(route))
+    ))
+
+def list_courses(client, limit, offset):
+    """Get a page of courses ordered by subject"""
+    policy = get_policy('courses_list')
+    def fetch():
+        query = client.query(kind='courses')
+        query.order = ['subject']
+        return list(query.fetch(limit=limit, offset=offset, **read_options('courses_list')))
+    return read_with_stale_fallback(
+        _stale_courses, ('list', limit, offset),
+        lambda: _course_reads.do((current_tenant().id, 'list', limit, offset, policy), fetch)
+    )
+
+def forget_course(course_id):
+    """Drop a course's fallback copy after it changes"""
+    _stale_courses.delete(('get', course_id))
+
+def get_user_entity(client, user_id):
+    """Get a user entity by id"""
+    return _user_reads.do(
+        (current_tenant().id, 'get', user_id),
+        lambda: client.get(client.key('users', user_id))
+    )
+
+def get_user_by_sub(client, sub):
+    """Get the user entity matching an Auth0 sub, or None"""
+    from flask import has_request_context, request
+    from utils.auth import CALLER_ENVIRON_KEY
+    if has_request_context():
+        # Sub-requests of POST /batch share the caller resolved for the batch
+        caller = request.environ.get(CALLER_ENVIRON_KEY)
+        if caller and caller[0] == sub:
+            return caller[1]
+    
+    def fetch():
+        query = client.query(kind='users')
+        query.add_filter('sub', '=', sub)
+        users = list(query.fetch())
+        return users[0] if users else None
+    return _user_reads.do((current_tenant().id, 'sub', sub), fetch)
 
 def create_user_entities():
     """Create the 9 required user entities in Datastore"""
@@ -23,8 +199,8 @@ def create_user_entities():
     
     for user_data in users_data:
         key = client.key('users')
-        entity = datastore.Entity(key=key)
+        entity = new_entity(key)
         entity.update(user_data)
         client.put(entity)
     
-    print("User entities created successfully")
+    logger.info("User entities created successfully")
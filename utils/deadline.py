@@ -0,0 +1,141 @@
+"""
+Request-scoped deadlines and retries for backend calls.
+
+Each request gets a time budget (REQUEST_DEADLINE_SECONDS). Every Datastore,
+Storage and Auth0 call goes through call_backend, which passes the remaining
+budget as the call's timeout and retries transient errors with jittered
+exponential backoff - only for idempotent calls and only while budget remains.
+Calls also pass through the dependency's circuit breaker (utils.circuit_breaker)
+and are recorded as spans in sampled traces (utils.tracing).
+"""
+from utils import metrics, tracing
+import contextvars
+import os
+import random
+import time
+
+REQUEST_DEADLINE_SECONDS = float(os.environ.get('REQUEST_DEADLINE_SECONDS', 10))
+# Budget for calls made outside a request, e.g. background jobs
+DEFAULT_CALL_TIMEOUT = float(os.environ.get('BACKEND_CALL_TIMEOUT', 30))
+MAX_ATTEMPTS = int(os.environ.get('BACKEND_MAX_ATTEMPTS', 3))
+BACKOFF_BASE = 0.05
+BACKOFF_CAP = 1.0
+# Not worth starting an attempt with less time than this left
+MIN_ATTEMPT_TIME = 0.05
+
+DEADLINE_ENVIRON_KEY = 'tarpaulin.deadline'
+
+deadline_var = contextvars.ContextVar('deadline', default=None)
+
+class BackendUnavailable(Exception):
+    """A backend call failed with a transient error after all allowed retries"""
+
+class DeadlineExceeded(BackendUnavailable):
+    """The request ran out of time budget for backend calls"""
+
+def remaining():
+    """Seconds left in the current request's budget, or None outside a request"""
+    deadline = deadline_var.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+def _is_transient(error):
+    """Check whether an error is worth retrying"""
+    from google.api_core import exceptions
+    import requests
+    return isinstance(error, (
+        exceptions.ServiceUnavailable,
+        exceptions.DeadlineExceeded,
+        exceptions.Aborted,
+        exceptions.InternalServerError,
+        exceptions.TooManyRequests,
+        exceptions.GatewayTimeout,
+        requests.ConnectionError,
+        requests.Timeout,
+        ConnectionError,
+        TimeoutError,
+    ))
+
+def call_backend(dependency, fn, *args, idempotent=True, google_retry=True, timeout_cap=None,
+                 max_attempts=None, trace_attributes=None, **kwargs):
+    """
+    Call fn(*args, **kwargs) with timeout set to the remaining budget
+    (at most timeout_cap per attempt, if given, and at most max_attempts
+    attempts, default BACKEND_MAX_ATTEMPTS), through the dependency's
+    circuit breaker. Google client calls also get retry=None so their own
+    retries do not run past the budget (set google_retry=False for other libraries).
+    The call, retries included, is one "<dependency>.<operation>" span.
+    """
+    operation = getattr(fn, '__name__', 'call')
+    with tracing.start_span(f"{dependency}.{operation}", **(trace_attributes or {})) as span:
+        return _call_with_retries(span, dependency, fn, args, idempotent, google_retry, timeout_cap,
+                                  max_attempts or MAX_ATTEMPTS, kwargs)
+
+def _call_with_retries(span, dependency, fn, args, idempotent, google_retry, timeout_cap, max_attempts, kwargs):
+    """Run call_backend's attempts"""
+    from utils import fault_injection
+    from utils.circuit_breaker import get_breaker
+    breaker = get_breaker(dependency)
+
+    attempt = 0
+    while True:
+        attempt += 1
+        if span is not None:
+            span.set_attribute('attempts', attempt)
+        budget = remaining()
+        timeout = DEFAULT_CALL_TIMEOUT if budget is None else budget
+        if timeout < MIN_ATTEMPT_TIME:
+            metrics.increment(f"deadline.{dependency}.exhausted")
+            raise DeadlineExceeded(f"No time left for {dependency} call")
+        if timeout_cap is not None:
+            timeout = min(timeout, timeout_cap)
+
+        call_kwargs = dict(kwargs, timeout=timeout)
+        if google_retry:
+            call_kwargs['retry'] = None
+        breaker.before_call()
+        try:
+            fault_injection.inject(dependency, timeout)
+            result = fn(*args, **call_kwargs)
+            breaker.record_success()
+            return result
+        except Exception as e:
+            if not _is_transient(e):
+                # The dependency answered, just not with success
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            metrics.increment(f"deadline.{dependency}.transient_errors")
+            if not idempotent or attempt >= max_attempts:
+                raise BackendUnavailable(f"{dependency} call failed: {e}") from e
+
+            delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            budget = remaining()
+            if budget is not None and budget - delay < MIN_ATTEMPT_TIME:
+                metrics.increment(f"deadline.{dependency}.exhausted")
+                raise DeadlineExceeded(f"No time left to retry {dependency} call") from e
+            metrics.increment(f"deadline.{dependency}.retries")
+            time.sleep(delay)
+
+def init_deadlines(app):
+    """Give each request a deadline and turn backend failures into 503s"""
+    from flask import g, request, jsonify
+
+    @app.before_request
+    def set_deadline():
+        # Sub-requests of POST /batch share the batch's deadline
+        deadline = request.environ.get(DEADLINE_ENVIRON_KEY)
+        if deadline is None:
+            deadline = time.monotonic() + REQUEST_DEADLINE_SECONDS
+        g.deadline_token = deadline_var.set(deadline)
+
+    @app.teardown_request
+    def clear_deadline(exc):
+        token = g.pop('deadline_token', None)
+        if token is not None:
+            deadline_var.reset(token)
+
+    @app.errorhandler(BackendUnavailable)
+    def backend_unavailable(e):
+        return jsonify({"Error": "Service unavailable"}), 503, {"Retry-After": "1"}
@@ -0,0 +1,67 @@
+"""
+Fault injection for exercising retries, breakers and stale serving locally.
+
+Off unless configured, either with FAULT_INJECTION="datastore=0.5,storage=1"
+(error rate per dependency) and FAULT_INJECTION_LATENCY="auth0=2.0" (seconds
+of added latency), or from code with set_fault(). Injected errors are the
+same transient errors the real clients raise.
+"""
+import os
+import random
+import threading
+import time
+
+_lock = threading.Lock()
+_faults = {}
+
+def _parse(value):
+    """Parse "name=number,..." into a dict"""
+    result = {}
+    for entry in value.split(','):
+        if '=' in entry:
+            name, number = entry.split('=', 1)
+            result[name.strip()] = float(number)
+    return result
+
+def set_fault(dependency, error_rate=0.0, latency=0.0):
+    """Make a dependency's calls fail with error_rate and take latency seconds longer"""
+    with _lock:
+        _faults[dependency] = (error_rate, latency)
+
+def clear_faults():
+    """Remove all injected faults"""
+    with _lock:
+        _faults.clear()
+
+def _load_from_environment():
+    """Read faults configured in the environment"""
+    error_rates = _parse(os.environ.get('FAULT_INJECTION', ''))
+    latencies = _parse(os.environ.get('FAULT_INJECTION_LATENCY', ''))
+    for dependency in set(error_rates) | set(latencies):
+        set_fault(dependency, error_rates.get(dependency, 0.0), latencies.get(dependency, 0.0))
+
+def inject(dependency, timeout=None):
+    """Apply any fault configured for a dependency before a real call"""
+    if not _faults:
+        return
+    with _lock:
+        error_rate, latency = _faults.get(dependency, (0.0, 0.0))
+    if latency:
+        if timeout is not None and latency >= timeout:
+            time.sleep(timeout)
+            raise _error(dependency, timeout=True)
+        time.sleep(latency)
+    if error_rate and random.random() < error_rate:
+        raise _error(dependency)
+
+def _error(dependency, timeout=False):
+    """Build the transient error the dependency's client would raise"""
+    if dependency == 'auth0':
+        import requests
+        return requests.Timeout("Injected fault") if timeout else requests.ConnectionError("Injected fault")
+    from google.api_core import exceptions
+    if timeout:
+        return exceptions.DeadlineExceeded("Injected fault")
+    return exceptions.ServiceUnavailable("Injected fault")
+
+_load_from_environment()
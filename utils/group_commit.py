@@ -0,0 +1,165 @@
+"""
+Cross-request group commit for enrollment writes.
+
+With ENROLLMENT_GROUP_COMMIT=true, enrollment puts and deletes from
+concurrent requests are buffered for ENROLLMENT_GROUP_COMMIT_MS and written
+with combined put_multi/delete_multi calls. Each request still returns only
+after the commit that carries its writes has succeeded; a request that runs
+out of time before its writes are taken for a commit withdraws them. Keys
+deleted by several requests are deleted once; if Datastore still rejects the
+combined commit, each request's writes are committed on their own so that
+only the requests with invalid writes fail.
+"""
+from utils import deadline, metrics
+from utils.tenancy import current_tenant
+import functools
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Datastore accepts at most 500 mutations per batch call
+MAX_BATCH = 500
+
+class _PendingWrite:
+    """One request's writes, waiting for their commit"""
+    def __init__(self, puts, deletes):
+        self.puts = puts
+        self.deletes = deletes
+        self.done = threading.Event()
+        self.error = None
+
+class WriteBatcher:
+    """Collects writes from many requests and commits them in shared batches"""
+    def __init__(self, name, get_client, window):
+        self.name = name
+        self.get_client = get_client
+        self.window = window
+        self._lock = threading.Condition()
+        self._pending = []
+        self._thread = None
+
+    def submit(self, puts, deletes):
+        """Queue writes and wait until they are committed"""
+        write = _PendingWrite(puts, deletes)
+        with self._lock:
+            self._pending.append(write)
+            self._start()
+            self._lock.notify()
+
+        budget = deadline.remaining()
+        if not write.done.wait(timeout=None if budget is None else max(budget, 0)):
+            with self._lock:
+                if write in self._pending:
+                    # Not taken by the flusher yet, so it will never be written
+                    self._pending.remove(write)
+                    raise deadline.DeadlineExceeded(f"Timed out waiting for {self.name} group commit")
+            # Already being committed; failing now would report a write that
+            # may well succeed, so wait for the outcome instead
+            write.done.wait()
+        if write.error is not None:
+            raise write.error
+
+    def _start(self):
+        """Start the flusher thread on first use (after any fork)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-group-commit", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """Flush buffered writes forever"""
+        while True:
+            with self._lock:
+                while not self._pending:
+                    self._lock.wait()
+            # Let concurrent requests join this batch
+            time.sleep(self.window)
+            with self._lock:
+                pending, self._pending = self._pending, []
+            for group in self._group(pending):
+                self._commit(group)
+
+    def _group(self, pending):
+        """Split requests into groups that fit in one put_multi and one delete_multi"""
+        group, puts, deletes = [], 0, 0
+        for write in pending:
+            if group and (puts + len(write.puts) > MAX_BATCH or deletes + len(write.deletes) > MAX_BATCH):
+                yield group
+                group, puts, deletes = [], 0, 0
+            group.append(write)
+            puts += len(write.puts)
+            deletes += len(write.deletes)
+        if group:
+            yield group
+
+    def _commit(self, group):
+        """Write one group and wake its requests"""
+        # Concurrent requests may remove the same enrollment, and Datastore
+        # rejects a commit that mutates one entity twice
+        deletes = list({key.flat_path: key for write in group for key in write.deletes}.values())
+        puts = [entity for write in group for entity in write.puts]
+        try:
+            write_batches(self.get_client(), puts, deletes)
+            errors = [None] * len(group)
+            metrics.increment(f"group_commit.{self.name}.commits")
+        except deadline.BackendUnavailable as e:
+            # Datastore is unavailable for everyone, writing one by one would not help
+            logger.warning("Error in %s group commit: %s", self.name, e)
+            errors = [e] * len(group)
+        except Exception as e:
+            # The combined commit was rejected; commit each request on its own
+            # so only requests whose own writes are invalid fail
+            logger.warning("Error in %s group commit, retrying per request: %s", self.name, e)
+            metrics.increment(f"group_commit.{self.name}.split")
+            errors = [self._commit_one(write) for write in group]
+        metrics.increment(f"group_commit.{self.name}.requests", len(group))
+        for write, error in zip(group, errors):
+            if error is not None:
+                metrics.increment(f"group_commit.{self.name}.errors")
+            write.error = error
+            write.done.set()
+
+    def _commit_one(self, write):
+        """Write one request's changes on their own and return the error, if any"""
+        try:
+            write_batches(self.get_client(), write.puts, write.deletes)
+            return None
+        except Exception as e:
+            logger.warning("Error in %s commit: %s", self.name, e)
+            return e
+
+def write_batches(client, puts, deletes):
+    """Write puts and deletes in chunks Datastore accepts"""
+    for i in range(0, len(puts), MAX_BATCH):
+        client.put_multi(puts[i:i + MAX_BATCH])
+    for i in range(0, len(deletes), MAX_BATCH):
+        client.delete_multi(deletes[i:i + MAX_BATCH])
+
+_enrollment_batchers = {}
+_enrollment_batcher_lock = threading.Lock()
+
+def get_enrollment_batcher():
+    """Get the process-wide enrollment write batcher for the current tenant"""
+    tenant = current_tenant()
+    batcher = _enrollment_batchers.get(tenant.id)
+    if batcher is None:
+        with _enrollment_batcher_lock:
+            batcher = _enrollment_batchers.get(tenant.id)
+            if batcher is None:
+                from utils.datastore_client import get_datastore_client
+                window = float(os.environ.get('ENROLLMENT_GROUP_COMMIT_MS', 5)) / 1000
+                # The flusher thread has no tenant of its own, so bind the client here
+                batcher = WriteBatcher('enrollments', functools.partial(get_datastore_client, tenant), window)
+                _enrollment_batchers[tenant.id] = batcher
+    return batcher
+
+def commit_enrollment_writes(client, puts, deletes):
+    """Write enrollment changes, through the group commit if it is enabled"""
+    if not puts and not deletes:
+        return
+    if os.environ.get('ENROLLMENT_GROUP_COMMIT', 'false').lower() == 'true':
+        get_enrollment_batcher().submit(puts, deletes)
+        return
+    write_batches(client, puts, deletes)
@@ -0,0 +1,330 @@
+"""
+Background jobs.
+
+Jobs run on an in-process worker pool. Their status and idempotency keys live
+in a job store, so whichever worker or instance serves GET /jobs/<id> sees the
+job, and a repeated Idempotency-Key returns the existing job wherever it was
+first submitted. JOB_STORE selects the store:
+- datastore (default): "jobs" and "job_idempotency_keys" entities in the
+  tenant's namespace, with an expires_at for a Datastore TTL policy
+- memory: this process only, for local development
+
+A job lives on the worker threads of the process that accepted it, which keeps
+a lease on it until it finishes; see JobQueue.
+"""
+from datetime import datetime, timedelta, timezone
+from utils import metrics
+from utils.tenancy import current_tenant, use_tenant
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+FINISHED = ('succeeded', 'failed')
+
+class Job:
+    """A unit of background work and its status"""
+    def __init__(self, name, fn, args, kwargs, idempotency_key=None, tenant=None):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        # Jobs run as the tenant that submitted them
+        self.tenant = tenant
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.idempotency_key = idempotency_key
+        self.status = 'queued'
+        self.attempts = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        # Renewed by the process holding the job until it finishes
+        self.lease_expires_at = None
+        self.lock = threading.Lock()
+
+    def abandoned(self):
+        """Check whether the process holding an unfinished job stopped renewing its lease"""
+        return (
+            self.status not in FINISHED
+            and self.lease_expires_at is not None
+            and self.lease_expires_at < time.time()
+        )
+
+    def to_dict(self):
+        """Convert job to dictionary for JSON responses"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "attempts": self.attempts,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at
+        }
+
+class MemoryJobStore:
+    """Job records in this process's memory"""
+    MAX_FINISHED_JOBS = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._idempotency_keys = {}
+
+    def add(self, job):
+        """Record a new job and claim its idempotency key; return the live job already holding the key, if any"""
+        with self._lock:
+            if job.idempotency_key:
+                key = (job.tenant, job.idempotency_key)
+                existing = self._jobs.get(self._idempotency_keys.get(key))
+                if existing is not None and not existing.abandoned():
+                    return existing
+                self._idempotency_keys[key] = job.id
+            self._jobs[job.id] = job
+        return None
+
+    def save(self, job):
+        """Record a job's current status"""
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+
+    def get(self, job_id):
+        """Get a job by id, or None"""
+        return self._jobs.get(job_id)
+
+    def _prune(self):
+        """Forget the oldest finished jobs once there are too many"""
+        finished = [job for job in self._jobs.values() if job.status in FINISHED]
+        if len(finished) <= self.MAX_FINISHED_JOBS:
+            return
+        finished.sort(key=lambda job: job.updated_at)
+        for job in finished[:len(finished) - self.MAX_FINISHED_JOBS]:
+            del self._jobs[job.id]
+            if job.idempotency_key:
+                self._idempotency_keys.pop((job.tenant, job.idempotency_key), None)
+
+class DatastoreJobStore:
+    """Job records in the current tenant's Datastore namespace, shared by every worker and instance"""
+    KIND = 'jobs'
+    IDEMPOTENCY_KIND = 'job_idempotency_keys'
+
+    def __init__(self, retention=None):
+        self.retention = retention or float(os.environ.get('JOB_RETENTION_SECONDS', 7 * 24 * 3600))
+
+    def _expires_at(self):
+        return datetime.now(timezone.utc) + timedelta(seconds=self.retention)
+
+    def _to_entity(self, client, job):
+        """Build the entity recording a job's current status"""
+        from utils.datastore_client import new_entity
+        entity = new_entity(client.key(self.KIND, job.id))
+        entity.exclude_from_indexes.update(('result', 'error'))
+        entity.update({
+            "name": job.name,
+            "tenant": job.tenant,
+            "idempotency_key": job.idempotency_key,
+            "status": job.status,
+            "attempts": job.attempts,
+            "result": json.dumps(job.result, default=str),
+            "error": job.error,
+            "created_at": job.created_at,
+            "updated_at": job.updated_at,
+            "lease_expires_at": job.lease_expires_at,
+            "expires_at": self._expires_at()
+        })
+        return entity
+
+    def _from_entity(self, job_id, entity):
+        """Rebuild a job's last recorded status from its entity"""
+        job = Job(entity['name'], None, (), {}, entity.get('idempotency_key'), entity.get('tenant'))
+        job.id = job_id
+        job.status = entity['status']
+        job.attempts = entity['attempts']
+        job.result = json.loads(entity['result']) if entity.get('result') else None
+        job.error = entity.get('error')
+        job.created_at = entity['created_at']
+        job.updated_at = entity['updated_at']
+        job.lease_expires_at = entity.get('lease_expires_at')
+        return job
+
+    def add(self, job):
+        """
+        Record a new job and claim its idempotency key in one transaction;
+        return the live job already holding the key, if any
+        """
+        from utils.datastore_client import get_datastore_client, new_entity
+
+        def add_job(client, timeout=None):
+            if job.idempotency_key:
+                # Client-supplied keys can be long or use reserved names, so store a digest
+                name = hashlib.sha256(job.idempotency_key.encode('utf-8')).hexdigest()
+                claim_key = client.key(self.IDEMPOTENCY_KIND, name)
+                claim = client.get(claim_key, timeout=timeout)
+                if claim is not None:
+                    existing = client.get(client.key(self.KIND, claim['job_id']), timeout=timeout)
+                    if existing is not None:
+                        existing = self._from_entity(claim['job_id'], existing)
+                        if not existing.abandoned():
+                            return existing
+                claim = new_entity(claim_key)
+                claim.update({"job_id": job.id, "expires_at": self._expires_at()})
+                client.put(claim)
+            client.put(self._to_entity(client, job))
+            return None
+
+        return get_datastore_client().run_in_transaction(add_job)
+
+    def save(self, job):
+        """Record a job's current status"""
+        from utils.datastore_client import get_datastore_client
+        client = get_datastore_client()
+        client.put(self._to_entity(client, job))
+
+    def get(self, job_id):
+        """Get a job's last recorded status by id, or None"""
+        from utils.datastore_client import get_datastore_client
+        client = get_datastore_client()
+        entity = client.get(client.key(self.KIND, job_id))
+        return None if entity is None else self._from_entity(job_id, entity)
+
+class JobQueue:
+    """
+    In-process job queue with a fixed worker pool, recording job status in a store.
+    Failed jobs are retried with exponential backoff, and jobs submitted with
+    an idempotency key already seen return the existing job instead of running again.
+
+    The process renews a lease on every job it holds until the job finishes. A job
+    whose lease runs out was lost with its process (a recycled worker, a stopped
+    instance): it reads as failed, and its idempotency key can be claimed again.
+    """
+    def __init__(self, workers=4, max_attempts=3, backoff=0.5, store=None, lease=60):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.store = store or MemoryJobStore()
+        self.lease = lease
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._held = {}
+
+    def submit(self, name, fn, *args, idempotency_key=None, **kwargs):
+        """Queue fn(*args, **kwargs) as the current tenant and return its Job"""
+        job = Job(name, fn, args, kwargs, idempotency_key, current_tenant().id)
+        job.lease_expires_at = time.time() + self.lease
+        existing = self.store.add(job)
+        if existing is not None:
+            metrics.increment("jobs.deduplicated")
+            return existing
+
+        with self._lock:
+            self._held[job.id] = job
+            self._start()
+        metrics.increment(f"jobs.{name}.submitted")
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        """Get a job by id, or None"""
+        job = self.store.get(job_id)
+        if job is not None and job.abandoned():
+            job.status = 'failed'
+            job.error = "The worker running this job stopped before it finished"
+        return job
+
+    def _start(self):
+        """Start the worker and lease threads on first use (after any fork)"""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._renew_leases, name='job-leases', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _save(self, job):
+        """Record a job's status and renew its lease; a store error does not fail the job"""
+        with job.lock:
+            job.lease_expires_at = None if job.status in FINISHED else time.time() + self.lease
+            try:
+                with use_tenant(job.tenant):
+                    self.store.save(job)
+            except Exception:
+                logger.exception("Error saving job %s", job.name, extra={"job_id": job.id})
+
+    def _renew_leases(self):
+        """Renew the lease on every job this process holds, forever"""
+        while True:
+            time.sleep(self.lease / 3)
+            with self._lock:
+                held = list(self._held.values())
+            for job in held:
+                self._save(job)
+
+    def _work(self):
+        """Run queued jobs forever"""
+        while True:
+            job = self._queue.get()
+            job.status = 'running'
+            job.attempts += 1
+            job.updated_at = time.time()
+            self._save(job)
+            try:
+                with use_tenant(job.tenant):
+                    job.result = job.fn(*job.args, **job.kwargs)
+                job.status = 'succeeded'
+                job.error = None
+                metrics.increment(f"jobs.{job.name}.succeeded")
+            except Exception as e:
+                logger.exception(
+                    "Error in job %s", job.name,
+                    extra={"job_id": job.id, "attempt": job.attempts}
+                )
+                job.error = str(e)
+                if job.attempts < self.max_attempts:
+                    job.status = 'queued'
+                    delay = self.backoff * (2 ** (job.attempts - 1)) * random.uniform(0.5, 1.5)
+                    timer = threading.Timer(delay, self._queue.put, args=(job,))
+                    timer.daemon = True
+                    timer.start()
+                    metrics.increment(f"jobs.{job.name}.retried")
+                else:
+                    job.status = 'failed'
+                    metrics.increment(f"jobs.{job.name}.failed")
+            finally:
+                job.updated_at = time.time()
+                if job.status in FINISHED:
+                    with self._lock:
+                        self._held.pop(job.id, None)
+                self._save(job)
+                self._queue.task_done()
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """Get the process-wide job queue, with the store chosen by JOB_STORE"""
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                store = MemoryJobStore() if os.environ.get('JOB_STORE') == 'memory' else DatastoreJobStore()
+                _job_queue = JobQueue(
+                    workers=int(os.environ.get('JOB_WORKERS', 4)),
+                    max_attempts=int(os.environ.get('JOB_MAX_ATTEMPTS', 3)),
+                    store=store,
+                    lease=float(os.environ.get('JOB_LEASE_SECONDS', 60))
+                )
+    return _job_queue
@@ -0,0 +1,161 @@
+"""
+Structured JSON logging that never blocks a request on log I/O.
+
+Records are put on a bounded in-memory queue and written to stdout by a
+background thread. Cloud Logging picks up the JSON lines and their severity.
+
+Per-module levels: LOG_LEVEL=INFO LOG_LEVELS="routes.auth_routes=WARNING,utils.jobs=DEBUG"
+Sampling: logger.info("...", extra={"sample_rate": 0.01}) keeps about 1% of those records.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+# Attributes every LogRecord has; anything else came from extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != 'sample_rate':
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class ContextFilter(logging.Filter):
+    """Drop sampled-out records and tag the rest with the current request id"""
+    def filter(self, record):
+        sample_rate = getattr(record, 'sample_rate', None)
+        if sample_rate is not None and random.random() >= sample_rate:
+            return False
+        if not hasattr(record, 'request_id'):
+            record.request_id = request_id_var.get()
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Queue records without formatting them, dropping records when the queue is full"""
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Resolve the message now, formatting is left to the writer thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class FlushingQueueListener(logging.handlers.QueueListener):
+    """Queue listener whose stop waits for room on a full queue, so queued records are still written"""
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel, timeout=5)
+
+_queue = None
+_handler = None
+_listener = None
+_lock = threading.Lock()
+
+def configure_logging():
+    """Route all logging through the queue and start the writer thread"""
+    global _queue, _handler
+    with _lock:
+        if _handler is not None:
+            return
+        _queue = queue.Queue(maxsize=int(os.environ.get('LOG_QUEUE_SIZE', 10000)))
+        _handler = NonBlockingQueueHandler(_queue)
+        _handler.addFilter(ContextFilter())
+
+        root = logging.getLogger()
+        root.handlers = [_handler]
+        root.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+        for entry in os.environ.get('LOG_LEVELS', '').split(','):
+            if '=' in entry:
+                name, level = entry.split('=', 1)
+                logging.getLogger(name.strip()).setLevel(level.strip().upper())
+        # The writer is a daemon thread; without this, records still queued
+        # when the process exits (often the errors that led to it) are lost
+        atexit.register(stop_listener)
+    start_listener()
+
+def start_listener():
+    """Start the background writer, also needed in each worker after fork"""
+    global _listener
+    if _queue is None:
+        return
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    _listener = FlushingQueueListener(_queue, stream, respect_handler_level=False)
+    _listener.start()
+
+def stop_listener():
+    """Flush queued records and stop the writer"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def dropped_count():
+    """Number of records dropped because the queue was full"""
+    return _handler.dropped if _handler else 0
+
+def init_request_logging(app):
+    """Give each request an id (X-Request-ID or generated) and log access lines"""
+    from flask import g, request
+
+    access_logger = logging.getLogger('access')
+    sample_rate = float(os.environ.get('ACCESS_LOG_SAMPLE_RATE', 1.0))
+
+    @app.before_request
+    def assign_request_id():
+        request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        g.request_id_token = request_id_var.set(request_id)
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        request_id = request_id_var.get()
+        if request_id:
+            response.headers['X-Request-ID'] = request_id
+        started = g.get('request_started')
+        if started is not None:
+            access_logger.info(
+                "%s %s %s", request.method, request.path, response.status_code,
+                extra={
+                    "status": response.status_code,
+                    "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                    "sample_rate": sample_rate
+                }
+            )
+        return response
+
+    @app.teardown_request
+    def clear_request_id(exc):
+        token = g.pop('request_id_token', None)
+        if token is not None:
+            request_id_var.reset(token)
@@ -0,0 +1,14 @@
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+
+def increment(name, amount=1):
+    """Increment a named process-local counter"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def snapshot():
+    """Get a copy of all counters"""
+    with _lock:
+        return dict(_counters)
@@ -0,0 +1,144 @@
+"""
+Opt-in profiling of live workers, off unless PROFILING_ENABLED=true.
+
+- Per-request cProfile: an admin sends X-Profile: 1; the response carries
+  X-Profile-Id and the pstats file is at GET /admin/profiles/<id>. Profiles
+  are kept in the bucket under profiles/, so any worker can serve them.
+- Sampling profiler: stacks of every thread sampled over a window, returned
+  directly as collapsed stacks ("frame;frame;frame count") for flamegraph tools.
+- tracemalloc snapshots of the top allocation sites.
+
+When disabled no hooks are registered, so requests pay nothing.
+"""
+from utils.deadline import call_backend
+import cProfile
+import collections
+import marshal
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# cProfile cannot reliably run two profilers at once, so profile one request at a time
+_request_profile_lock = threading.Lock()
+
+def profiling_enabled():
+    """Check whether the profiling surface is switched on"""
+    return os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+
+def _profile_blob(profile_id):
+    """Get the bucket object for a request profile of the current tenant"""
+    from utils.storage import get_storage_client
+    from utils.tenancy import current_tenant
+    bucket_name = os.environ.get('PROFILE_BUCKET') or os.environ.get('BUCKET_NAME', 'tume-tarpaulin-avatars')
+    bucket = get_storage_client().bucket(bucket_name)
+    return bucket.blob(f"profiles/{current_tenant().id}/{profile_id}.pstats")
+
+def store_profile(data):
+    """Upload a finished request profile and return its id"""
+    profile_id = uuid.uuid4().hex
+    blob = _profile_blob(profile_id)
+    call_backend('storage', blob.upload_from_string, data, content_type='application/octet-stream',
+                 trace_attributes={"blob": blob.name})
+    return profile_id
+
+def load_profile(profile_id):
+    """Download a request profile, or None"""
+    if not re.fullmatch(r'[0-9a-f]{32}', profile_id):
+        return None
+    blob = _profile_blob(profile_id)
+    if not call_backend('storage', blob.exists, trace_attributes={"blob": blob.name}):
+        return None
+    return call_backend('storage', blob.download_as_bytes, trace_attributes={"blob": blob.name})
+
+def pstats_bytes(profiler):
+    """Serialize a profiler's stats in the format pstats.Stats() loads"""
+    profiler.create_stats()
+    return marshal.dumps(profiler.stats)
+
+def sample_stacks(seconds, interval):
+    """Sample every other thread's stack for a window and return collapsed stacks"""
+    own_thread = threading.get_ident()
+    counts = collections.Counter()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            counts[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    return '\n'.join(f"{stack} {count}" for stack, count in counts.most_common()).encode('utf-8')
+
+def tracemalloc_top(limit):
+    """Get the top allocation sites of a tracemalloc snapshot"""
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "current_bytes": current,
+        "peak_bytes": peak,
+        "top": [
+            {"location": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+            for stat in snapshot.statistics('lineno')[:limit]
+        ]
+    }
+
+def is_admin_request():
+    """Check the request's bearer token belongs to an admin"""
+    from utils.auth import get_token_auth_header, verify_decode_jwt
+    from utils.datastore_client import get_datastore_client, get_user_by_sub
+    token = get_token_auth_header()
+    payload = verify_decode_jwt(token) if token else None
+    if not payload:
+        return False
+    user = get_user_by_sub(get_datastore_client(), payload.get('sub'))
+    return bool(user) and user['role'] == 'admin'
+
+def init_profiling(app):
+    """Profile admin requests that ask for it with X-Profile: 1"""
+    if not profiling_enabled():
+        return
+    from flask import g, request
+
+    @app.before_request
+    def start_request_profile():
+        if request.headers.get('X-Profile') != '1' or not is_admin_request():
+            return
+        if not _request_profile_lock.acquire(blocking=False):
+            g.profile_skipped = True
+            return
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+    @app.after_request
+    def finish_request_profile(response):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            _request_profile_lock.release()
+            try:
+                response.headers['X-Profile-Id'] = store_profile(pstats_bytes(profiler))
+            except Exception as e:
+                logger.warning("Error storing request profile: %s", e)
+                response.headers['X-Profile-Skipped'] = 'the profile could not be stored'
+        elif g.pop('profile_skipped', False):
+            response.headers['X-Profile-Skipped'] = 'another request is being profiled'
+        return response
+
+    @app.teardown_request
+    def release_request_profile(exc):
+        # after_request does not run when a request fails with an unhandled error
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            _request_profile_lock.release()
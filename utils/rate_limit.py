@@ -0,0 +1,169 @@
+from functools import wraps
+from flask import request, jsonify
+from utils import metrics
+from utils.tenancy import current_tenant
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Endpoint class: (tokens per second, burst, max in-flight requests).
+# Override with RATE_LIMIT_<CLASS>="rate,burst,max_in_flight".
+DEFAULT_LIMITS = {
+    'enrollment': (5, 20, 8),
+    'avatar': (2, 10, 4),
+    'admin': (5, 20, 8),
+    'batch': (2, 10, 4),
+}
+
+class MemoryBackend:
+    """Process-local token buckets"""
+    MAX_BUCKETS = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, key, rate, burst):
+        """Take one token; return 0 if allowed, else seconds until one is available"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, _ = self._buckets.get(key, (burst, now, 0))
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens >= 1:
+                wait = 0
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now, (burst - tokens) / rate)
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._prune(now)
+        return wait
+
+    def _prune(self, now):
+        """Drop buckets that have refilled, they are equivalent to new ones"""
+        for key, (tokens, last, refill_time) in list(self._buckets.items()):
+            if now - last >= refill_time:
+                del self._buckets[key]
+
+class RedisBackend:
+    """Token buckets shared between instances through Redis"""
+    SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("RATE_LIMIT_REDIS_URL needs the redis package: pip install redis") from None
+        try:
+            self._client = redis.Redis.from_url(url)
+        except ValueError as e:
+            raise ValueError(f"RATE_LIMIT_REDIS_URL is invalid: {e}") from None
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def take(self, key, rate, burst):
+        """Take one token; return 0 if allowed, else seconds until one is available"""
+        return float(self._script(keys=[f"ratelimit:{key}"], args=[rate, burst, time.time()]))
+
+_backend = None
+_backend_lock = threading.Lock()
+_slots = {}
+
+def get_backend():
+    """Get the counter backend, shared through Redis if RATE_LIMIT_REDIS_URL is set"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                redis_url = os.environ.get('RATE_LIMIT_REDIS_URL')
+                _backend = RedisBackend(redis_url) if redis_url else MemoryBackend()
+    return _backend
+
+def set_backend(backend):
+    """Replace the counter backend (any object with take(key, rate, burst))"""
+    global _backend
+    _backend = backend
+
+def get_limits(endpoint_class):
+    """Get (rate, burst, max_in_flight) for an endpoint class"""
+    override = os.environ.get(f"RATE_LIMIT_{endpoint_class.upper()}")
+    if override:
+        rate, burst, max_in_flight = override.split(',')
+        return float(rate), float(burst), int(max_in_flight)
+    return DEFAULT_LIMITS[endpoint_class]
+
+def validate_limits():
+    """Check the RATE_LIMIT_* settings and build the backend at startup, so a bad setting fails the deploy rather than each request"""
+    get_backend()
+    for endpoint_class in DEFAULT_LIMITS:
+        name = f"RATE_LIMIT_{endpoint_class.upper()}"
+        try:
+            rate, burst, max_in_flight = get_limits(endpoint_class)
+        except ValueError:
+            raise ValueError(f"{name} must be \"rate,burst,max_in_flight\"") from None
+        if not 0 < rate < math.inf or not 1 <= burst < math.inf or max_in_flight < 1:
+            raise ValueError(f"{name} needs a positive rate, a burst of at least 1 and at least 1 in flight")
+
+def _get_slots(endpoint_class, max_in_flight):
+    """Get the current tenant's in-flight semaphore for an endpoint class"""
+    key = (current_tenant().id, endpoint_class)
+    with _backend_lock:
+        if key not in _slots:
+            _slots[key] = threading.BoundedSemaphore(max_in_flight)
+        return _slots[key]
+
+def _reject(status, retry_after, endpoint_class):
+    """Build a fast rejection response"""
+    metrics.increment(f"rate_limit.{endpoint_class}.{status}")
+    message = "Too many requests" if status == 429 else "Service unavailable"
+    return jsonify({"Error": message}), status, {"Retry-After": str(max(1, math.ceil(retry_after)))}
+
+def rate_limited(endpoint_class):
+    """Decorator to apply per-caller token buckets and a per-tenant in-flight cap, use below requires_auth"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(payload, *args, **kwargs):
+            if os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'false':
+                return f(payload, *args, **kwargs)
+
+            rate, burst, max_in_flight = get_limits(endpoint_class)
+            try:
+                key = f"{current_tenant().id}:{request.endpoint}:{payload.get('sub')}"
+                wait = get_backend().take(key, rate, burst)
+            except Exception as e:
+                # Fail open, a broken shared counter must not take the API down
+                logger.warning("Rate limit backend error: %s", e, extra={"sample_rate": 0.1})
+                metrics.increment("rate_limit.backend_errors")
+                wait = 0
+            if wait > 0:
+                return _reject(429, wait, endpoint_class)
+
+            slots = _get_slots(endpoint_class, max_in_flight)
+            if not slots.acquire(blocking=False):
+                return _reject(503, 1, endpoint_class)
+            try:
+                return f(payload, *args, **kwargs)
+            finally:
+                slots.release()
+        return decorated
+    return decorator
@@ -0,0 +1,56 @@
+"""
+Per-route read consistency for Datastore reads.
+
+Each read-only route has a policy, set with READ_POLICY_<ROUTE>:
+- strong: see every committed write (default)
+- eventual: skip the consistency check; may miss very recent writes
+- stale:<seconds>: read a snapshot from <seconds> ago (read_time); never
+  more than that far behind, and cheaper to serve than a strong read
+
+Authorization lookups and reads on mutation paths do not take a policy
+and are always strong.
+"""
+from datetime import datetime, timedelta, timezone
+import os
+
+# Routes that may trade freshness for latency
+ROUTES = ('courses_list', 'course_get', 'users_list', 'user_courses')
+
+# Datastore only serves read_time snapshots from the last hour, measured when
+# the RPC arrives; keep a minute's margin for the time the call takes to get there
+MAX_STALENESS_SECONDS = 3540
+
+def get_policy(route):
+    """Get the configured policy string for a route"""
+    return os.environ.get(f"READ_POLICY_{route.upper()}", 'strong').lower()
+
+def parse_policy(policy):
+    """Split a policy into its mode and staleness in seconds, or raise ValueError"""
+    if policy in ('strong', 'eventual'):
+        return policy, None
+    if policy.startswith('stale:'):
+        try:
+            seconds = float(policy.split(':', 1)[1])
+        except ValueError:
+            seconds = None
+        if seconds is None or not 0 < seconds < float('inf'):
+            raise ValueError(f"Invalid staleness in read policy {policy!r}")
+        return 'stale', min(seconds, MAX_STALENESS_SECONDS)
+    raise ValueError(f"Unknown read policy {policy!r}")
+
+def validate_policies():
+    """Check every route's policy at startup, so a bad setting fails the deploy rather than each request"""
+    for route in ROUTES:
+        try:
+            parse_policy(get_policy(route))
+        except ValueError as e:
+            raise ValueError(f"READ_POLICY_{route.upper()}: {e}") from None
+
+def read_options(route):
+    """Get the Datastore get/fetch keyword arguments for a route's policy"""
+    mode, seconds = parse_policy(get_policy(route))
+    if mode == 'eventual':
+        return {"eventual": True}
+    if mode == 'stale':
+        return {"read_time": datetime.now(timezone.utc) - timedelta(seconds=seconds)}
+    return {}
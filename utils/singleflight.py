@@ -0,0 +1,58 @@
+import threading
+from utils import deadline, metrics
+
+class _Call:
+    """An in-flight call whose result is shared with duplicate callers"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Collapse concurrent calls that share a key into one backend call.
+    Callers that arrive while a call is in flight wait for it and get the same result.
+    """
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Run fn for key, or wait on the call already in flight for key"""
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = _Call()
+                    self._calls[key] = call
+
+            if leader:
+                break
+
+            metrics.increment(f"singleflight.{self.name}.coalesced")
+            # Wait no longer than this request's own budget
+            budget = deadline.remaining()
+            if not call.done.wait(timeout=None if budget is None else max(budget, 0)):
+                raise deadline.DeadlineExceeded(f"Timed out waiting for shared {self.name} read")
+            if isinstance(call.error, deadline.DeadlineExceeded):
+                # The leader ran out of its own budget, which says nothing
+                # about ours; try again, leading the call if none is in flight
+                metrics.increment(f"singleflight.{self.name}.retried")
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        metrics.increment(f"singleflight.{self.name}.calls")
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
@@ -1,9 +1,49 @@
-from google.cloud import storage
+import functools
 import os
+import threading
+
+_client = None
+_client_lock = threading.Lock()
 
 def get_storage_client():
-    """Get Cloud Storage client"""
-    return storage.Client()
+    """Get the process-wide Cloud Storage client, created on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from google.cloud import storage
+                _client = storage.Client()
+    return _client
+
+def get_signing_kwargs(client, timeout=None):
+    """
+    Get extra generate_signed_url arguments for the client's credentials.
+    Service account keys sign locally; other credentials (e.g. the App Engine
+    default account) sign through the IAM API with their access token, which
+    is refreshed here within timeout if needed.
+    """
+    from google.auth.credentials import Signing
+    credentials = client._credentials
+    if isinstance(credentials, Signing):
+        return {}
+    
+    from google.auth.transport.requests import Request
+    if not credentials.valid:
+        credentials.refresh(functools.partial(Request(), timeout=timeout) if timeout else Request())
+    return {
+        "service_account_email": credentials.service_account_email,
+        "access_token": credentials.token
+    }
+
+def avatar_blob_name(user_id):
+    """Get the object name of a user's avatar under the current tenant's prefix"""
+    from utils.tenancy import current_tenant
+    return f"{current_tenant().avatar_prefix}{user_id}.png"
+
+def reset_storage_client():
+    """Drop the cached client, e.g. in a worker after fork"""
+    global _client
+    _client = None
 
 def upload_avatar(user_id, file_content, filename):
     """Upload avatar to Cloud Storage"""
@@ -11,7 +51,7 @@ def upload_avatar(user_id, file_content, filename):
     bucket_name = os.environ.get('BUCKET_NAME', 'tume-tarpaulin-avatars')
     bucket = client.bucket(bucket_name)
     
-    blob_name = f"avatars/{user_id}.png"
+    blob_name = avatar_blob_name(user_id)
     blob = bucket.blob(blob_name)
     blob.upload_from_string(file_content, content_type='image/png')
     
@@ -23,7 +63,7 @@ def get_avatar(user_id):
     bucket_name = os.environ.get('BUCKET_NAME', 'tume-tarpaulin-avatars')
     bucket = client.bucket(bucket_name)
     
-    blob_name = f"avatars/{user_id}.png"
+    blob_name = avatar_blob_name(user_id)
     blob = bucket.blob(blob_name)
     
     if blob.exists():
@@ -36,7 +76,7 @@ def delete_avatar(user_id):
     bucket_name = os.environ.get('BUCKET_NAME', 'tume-tarpaulin-avatars')
     bucket = client.bucket(bucket_name)
     
-    blob_name = f"avatars/{user_id}.png"
+    blob_name = avatar_blob_name(user_id)
     blob = bucket.blob(blob_name)
     
     if blob.exists():
@@ -0,0 +1,139 @@
+"""
+Serving several institutions (tenants) from one deployment.
+
+TENANTS maps tenant ids to their settings, as JSON:
+
+    {"osu": {"hosts": ["api.osu.example.edu"], "namespace": "osu",
+             "avatar_prefix": "osu/avatars/", "cache_entries": {"signed_urls": 2000}}}
+
+namespace defaults to the tenant id and avatar_prefix to "<id>/avatars/".
+A request's tenant comes from its Host header or, for hosts not listed, from
+the TENANT_CLAIM claim of its bearer token; a token claiming a different
+tenant than its host is rejected. Everything else uses the default tenant:
+the default Datastore namespace and avatars/, as with a single deployment.
+
+Each tenant gets its own Datastore client, cache partitions capped at its own
+entry budget, rate limit buckets and in-flight slots.
+"""
+from contextlib import contextmanager
+from utils.cache import TTLCache
+import contextvars
+import json
+import os
+import threading
+
+DEFAULT_TENANT_ID = 'default'
+
+tenant_var = contextvars.ContextVar('tenant', default=None)
+
+class Tenant:
+    """One institution's namespace, storage prefix and cache budgets"""
+    def __init__(self, tenant_id, hosts=(), namespace=None, avatar_prefix='avatars/', cache_entries=None):
+        self.id = tenant_id
+        self.hosts = [host.lower() for host in hosts]
+        self.namespace = namespace
+        self.avatar_prefix = avatar_prefix
+        self.cache_entries = cache_entries or {}
+
+DEFAULT_TENANT = Tenant(DEFAULT_TENANT_ID)
+
+_tenants = None
+_tenants_lock = threading.Lock()
+
+def get_tenants():
+    """Get the configured tenants by id, the default tenant included"""
+    global _tenants
+    if _tenants is None:
+        with _tenants_lock:
+            if _tenants is None:
+                tenants = {DEFAULT_TENANT_ID: DEFAULT_TENANT}
+                for tenant_id, settings in json.loads(os.environ.get('TENANTS') or '{}').items():
+                    tenants[tenant_id] = Tenant(
+                        tenant_id,
+                        hosts=settings.get('hosts', []),
+                        namespace=settings.get('namespace', tenant_id),
+                        avatar_prefix=settings.get('avatar_prefix', f"{tenant_id}/avatars/"),
+                        cache_entries=settings.get('cache_entries')
+                    )
+                _tenants = tenants
+    return _tenants
+
+def multi_tenant():
+    """Check whether any tenant besides the default is configured"""
+    return len(get_tenants()) > 1
+
+def current_tenant():
+    """Get the tenant of the current request or job"""
+    return tenant_var.get() or DEFAULT_TENANT
+
+@contextmanager
+def use_tenant(tenant_id):
+    """Run a block as the given tenant, e.g. a background job"""
+    token = tenant_var.set(get_tenants().get(tenant_id, DEFAULT_TENANT))
+    try:
+        yield
+    finally:
+        tenant_var.reset(token)
+
+def resolve_tenant(host, payload):
+    """Get the tenant for a host and token payload, or None if they disagree"""
+    tenants = get_tenants()
+    by_host = next((t for t in tenants.values() if host in t.hosts), None)
+    claimed = (payload or {}).get(os.environ.get('TENANT_CLAIM', 'tenant'))
+    if claimed is None:
+        return by_host or DEFAULT_TENANT
+    if claimed not in tenants or (by_host and by_host.id != claimed):
+        return None
+    return tenants[claimed]
+
+class TenantCache:
+    """TTLCache with a separate partition per tenant, each capped at that tenant's budget"""
+    def __init__(self, name, max_entries=10000):
+        self.name = name
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._caches = {}
+
+    def _cache(self):
+        tenant = current_tenant()
+        cache = self._caches.get(tenant.id)
+        if cache is None:
+            with self._lock:
+                cache = self._caches.get(tenant.id)
+                if cache is None:
+                    cache = TTLCache(tenant.cache_entries.get(self.name, self.max_entries))
+                    self._caches[tenant.id] = cache
+        return cache
+
+    def get(self, key):
+        """Get a live value for the current tenant, or None"""
+        return self._cache().get(key)
+
+    def set(self, key, value, ttl):
+        """Store a value for the current tenant"""
+        self._cache().set(key, value, ttl)
+
+    def delete(self, key):
+        """Drop a value for the current tenant"""
+        self._cache().delete(key)
+
+def init_tenancy(app):
+    """Resolve each request's tenant; does nothing unless TENANTS is set"""
+    if not multi_tenant():
+        return
+    from flask import g, request, jsonify
+    from utils.auth import get_token_auth_header, verify_decode_jwt
+
+    @app.before_request
+    def set_tenant():
+        token = get_token_auth_header()
+        tenant = resolve_tenant(request.host.split(':')[0].lower(), verify_decode_jwt(token) if token else None)
+        if tenant is None:
+            return jsonify({"Error": "Unauthorized"}), 401
+        g.tenant_token = tenant_var.set(tenant)
+
+    @app.teardown_request
+    def clear_tenant(exc):
+        token = g.pop('tenant_token', None)
+        if token is not None:
+            tenant_var.reset(token)
@@ -0,0 +1,201 @@
+"""
+Per-request tracing spans.
+
+Each request is sampled on arrival (head-based) with TRACING_SAMPLE_RATE, or
+when its traceparent header says it was sampled upstream. Sampled requests get
+a root span; requires_auth and every backend call made through call_backend
+add child spans. Finished traces go to the exporter chosen by TRACING_EXPORTER:
+"file:<path>" (JSON lines, written by a background thread), "memory" (kept in
+a list, for tests) or "none". Unsampled requests only pay for one contextvar lookup.
+"""
+from contextlib import contextmanager
+from utils.tenancy import current_tenant
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+
+current_span_var = contextvars.ContextVar('current_span', default=None)
+
+PARENT_SPAN_ENVIRON_KEY = 'tarpaulin.parent_span'
+
+class Trace:
+    """The spans of one sampled request"""
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+class Span:
+    """A timed operation within a trace"""
+    def __init__(self, name, trace, parent=None, attributes=None):
+        self.name = name
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_error(self, error):
+        self.status = 'error'
+        self.attributes['error'] = f"{type(error).__name__}: {error}"
+
+    def end(self):
+        self.duration_ms = round((time.perf_counter() - self._start) * 1000, 3)
+        self.trace.add(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "attributes": self.attributes
+        }
+
+class InMemoryExporter:
+    """Keeps finished traces in a list"""
+    def __init__(self):
+        self.traces = []
+
+    def export(self, trace):
+        self.traces.append([span.to_dict() for span in trace.spans])
+
+class FileExporter:
+    """Appends spans as JSON lines from a background thread"""
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.Queue(maxsize=10000)
+        self._thread = None
+
+    def export(self, trace):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='trace-file-exporter', daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait([span.to_dict() for span in trace.spans])
+        except queue.Full:
+            pass
+
+    def _run(self):
+        while True:
+            spans = self._queue.get()
+            with open(self.path, 'a') as f:
+                for span in spans:
+                    f.write(json.dumps(span, default=str) + '\n')
+
+_exporter = None
+_exporter_loaded = False
+
+def get_exporter():
+    """Get the configured exporter, or None"""
+    global _exporter, _exporter_loaded
+    if not _exporter_loaded:
+        setting = os.environ.get('TRACING_EXPORTER', 'none')
+        if setting.startswith('file:'):
+            _exporter = FileExporter(setting[len('file:'):])
+        elif setting == 'memory':
+            _exporter = InMemoryExporter()
+        _exporter_loaded = True
+    return _exporter
+
+def set_exporter(exporter):
+    """Replace the exporter (any object with export(trace))"""
+    global _exporter, _exporter_loaded
+    _exporter = exporter
+    _exporter_loaded = True
+
+@contextmanager
+def start_span(name, **attributes):
+    """Time a block as a child of the current span; does nothing outside a sampled trace"""
+    parent = current_span_var.get()
+    if parent is None:
+        yield None
+        return
+    span = Span(name, parent.trace, parent, attributes)
+    token = current_span_var.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.record_error(e)
+        raise
+    finally:
+        current_span_var.reset(token)
+        span.end()
+
+def _is_hex(value, length):
+    return len(value) == length and all(c in '0123456789abcdef' for c in value)
+
+def _sampled_upstream(traceparent):
+    """Read the trace id and sampled flag (bit 0 of the trace flags) from a W3C traceparent header"""
+    parts = (traceparent or '').split('-')
+    if (len(parts) == 4 and _is_hex(parts[0], 2) and _is_hex(parts[1], 32)
+            and _is_hex(parts[2], 16) and _is_hex(parts[3], 2)
+            and parts[1] != '0' * 32 and parts[2] != '0' * 16):
+        return parts[1], bool(int(parts[3], 16) & 1)
+    return None, False
+
+def init_tracing(app):
+    """Open a root span for sampled requests and export it when the request ends"""
+    from flask import g, request
+
+    sample_rate = float(os.environ.get('TRACING_SAMPLE_RATE', 0))
+
+    @app.before_request
+    def start_request_span():
+        parent = request.environ.get(PARENT_SPAN_ENVIRON_KEY)
+        if parent is None:
+            trace_id, sampled = _sampled_upstream(request.headers.get('traceparent'))
+            if not sampled and random.random() >= sample_rate:
+                return
+            if get_exporter() is None:
+                return
+        span = Span(
+            f"{request.method} {request.url_rule.rule if request.url_rule else request.path}",
+            parent.trace if parent else Trace(trace_id),
+            parent,
+            {"http.method": request.method, "http.path": request.path, "tenant": current_tenant().id}
+        )
+        g.trace_span = span
+        g.trace_token = current_span_var.set(span)
+
+    @app.after_request
+    def tag_request_span(response):
+        span = g.get('trace_span')
+        if span is not None:
+            span.set_attribute('http.status_code', response.status_code)
+            if response.status_code >= 500:
+                span.status = 'error'
+        return response
+
+    @app.teardown_request
+    def end_request_span(exc):
+        span = g.pop('trace_span', None)
+        if span is None:
+            return
+        current_span_var.reset(g.pop('trace_token'))
+        if exc is not None:
+            span.record_error(exc)
+        span.end()
+        # Batch sub-requests belong to the batch's trace, which exports them
+        if span.parent_id is None:
+            exporter = get_exporter()
+            if exporter is not None:
+                exporter.export(span.trace)